@@ -2,6 +2,7 @@ import mysql.connector
 import matplotlib.pyplot as plt
 import pandas as pd
 import configparser
+import stageProfiler
 
 
 def read_config(config_path='config.ini'):
@@ -58,8 +59,10 @@ def main():
     connection = connect_to_database(db_config)
 
     if connection:
-        df = fetch_customer_revenue_data(connection)
-        plot_customer_revenue(df)
+        with stageProfiler.span('fetch', 'customer revenue'):
+            df = fetch_customer_revenue_data(connection)
+        with stageProfiler.span('plot', 'revenue distribution'):
+            plot_customer_revenue(df)
         connection.close()
     else:
         print("Failed to connect to the database.")
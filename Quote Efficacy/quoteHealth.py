@@ -1,9 +1,11 @@
 import os
 import sys
+import json
 import pandas as pd
 import mysql.connector
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, text
 import configparser
+from datetime import datetime, timedelta
 
 # Get the directory of the current script
 current_dir = os.path.dirname(os.path.abspath(__file__))
@@ -11,6 +13,12 @@ current_dir = os.path.dirname(os.path.abspath(__file__))
 # Go up one level to the parent directory
 parent_dir = os.path.dirname(current_dir)
 
+# Make the shared top-level modules importable
+sys.path.insert(0, parent_dir)
+import dimensionStore
+import stageProfiler
+import outputWriter
+
 # Construct the path to the config file
 config_path = os.path.join(parent_dir, 'config.ini')
 
@@ -32,48 +40,215 @@ except KeyError as e:
     print(f"Error: Missing key in 'mysql' configuration: {e}")
     sys.exit(1)
 
+# Conversion state carried between runs:
+#   quote_conversion_state.json   watermarks, running rate totals and the quotes still open, written
+#                                 atomically as one checkpoint; the totals are never re-read from the outputs
+#   quote_conversion_settled.csv  append-only history of settled quotes; bytes past the checkpoint's
+#                                 offset were appended by an interrupted run and are dropped on load
+STATE_PATH = os.path.join(current_dir, 'quote_conversion_state.json')
+SETTLED_PATH = os.path.join(current_dir, 'quote_conversion_settled.csv')
+STATE_COLUMNS = ['QUOTE_SID', 'CUSTOMER_SID', 'CUSTOMER_CODE', 'DATE_CREATED_SID', 'EXPIRATION_DATE_SID', 'QUOTE_VALUE',
+                 'CONVERTED', 'CLOSED']
+RATE_KEYS = ['CUSTOMER_CODE', 'VALUE_RANGE', 'QUOTE_MONTH']
+# Bumped when the checkpoint layout changes; an older checkpoint is discarded and the state rebuilt
+STATE_FORMAT = 2
+
+# Rate table outputs, regenerated from the totals every run
+# (paths without extension; outputWriter adds one per configured format)
+CUSTOMER_RATES_PATH = os.path.join(current_dir, 'customer_conversion_rates')
+VALUE_RANGE_RATES_PATH = os.path.join(current_dir, 'value_range_conversion_rates')
+TIME_RATES_PATH = os.path.join(current_dir, 'time_conversion_rates')
+
+# Fixed value bins so a quote always lands in the same range from run to run
+VALUE_BINS = [-float('inf'), 1000, 5000, 10000, 50000, 100000, float('inf')]
+VALUE_LABELS = ['<1K', '1K-5K', '5K-10K', '10K-50K', '50K-100K', '100K+']
+
+# Days after EXPIRATION_DATE during which late-posted sales lines can still convert a quote
+SETTLE_DAYS = 7
+
+
+def empty_state():
+    return {'format': STATE_FORMAT, 'watermark': 0, 'last_quote_sid': 0, 'settled_bytes': 0,
+            'totals': {key: {'VALUES': [], 'QUOTES': [], 'CONVERTED': []} for key in RATE_KEYS},
+            'open': pd.DataFrame(columns=STATE_COLUMNS)}
+
+
+def load_state():
+    # Without a checkpoint every quote is evaluated again, so the settled history starts over too
+    state = empty_state()
+    if os.path.exists(STATE_PATH):
+        with open(STATE_PATH) as f:
+            checkpoint = json.load(f)
+        if checkpoint.get('format') == STATE_FORMAT:
+            state = checkpoint
+            state['open'] = pd.DataFrame(state['open'], columns=STATE_COLUMNS)
+        else:
+            print(f"Ignoring quote conversion checkpoint with format {checkpoint.get('format')}; rebuilding")
+    if os.path.exists(SETTLED_PATH) and os.path.getsize(SETTLED_PATH) > state['settled_bytes']:
+        os.truncate(SETTLED_PATH, state['settled_bytes'])
+    return state
+
+
+def append_settled(state, settled):
+    if len(settled):
+        settled[STATE_COLUMNS].to_csv(SETTLED_PATH, mode='a', index=False, header=state['settled_bytes'] == 0)
+        state['settled_bytes'] = os.path.getsize(SETTLED_PATH)
+
+
+def save_state(state):
+    checkpoint = dict(state, open=state['open'][STATE_COLUMNS].to_dict(orient='list'))
+    tmp_path = STATE_PATH + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(checkpoint, f)
+    os.replace(tmp_path, STATE_PATH)
+
+
+def fetch_sales(engine, customers, query, params):
+    sales = pd.read_sql(text(query), engine, params=params)
+    sales['CUSTOMER_CODE'] = dimensionStore.lookup(customers, 'CUSTOMER_CODE', sales['BILL_CUSTOMER_SID'])
+    return sales
+
+
+def find_conversions(quotes, sales):
+    # A quote converts when its customer has a sale of exactly QUOTE_VALUE inside [QUOTE_DATE, EXPIRATION_DATE]
+    if quotes.empty or sales.empty:
+        return pd.Series(False, index=quotes.index)
+    candidates = quotes.reset_index()[['index', 'CUSTOMER_CODE', 'QUOTE_VALUE', 'DATE_CREATED_SID', 'EXPIRATION_DATE_SID']]
+    candidates = candidates.dropna(subset=['CUSTOMER_CODE'])
+    pairs = candidates.merge(
+        sales.dropna(subset=['CUSTOMER_CODE'])[['CUSTOMER_CODE', 'EXTENDED_PRICE', 'DOCUMENT_DATE_SID']],
+        left_on=['CUSTOMER_CODE', 'QUOTE_VALUE'], right_on=['CUSTOMER_CODE', 'EXTENDED_PRICE'])
+    in_window = ((pairs['DOCUMENT_DATE_SID'] >= pairs['DATE_CREATED_SID']) &
+                 (pairs['DOCUMENT_DATE_SID'] <= pairs['EXPIRATION_DATE_SID']))
+    return pd.Series(quotes.index.isin(pairs.loc[in_window, 'index']), index=quotes.index)
+
+
+def add_rate_keys(quotes):
+    quotes = quotes.copy()
+    quotes['VALUE_RANGE'] = pd.cut(quotes['QUOTE_VALUE'], bins=VALUE_BINS, labels=VALUE_LABELS).astype(str)
+    quotes['QUOTE_MONTH'] = (quotes['DATE_CREATED_SID'] // 100).astype(int).astype(str)
+    return quotes
+
+
+def update_totals(totals, delta):
+    for key in RATE_KEYS:
+        counts = delta.groupby(key)[['QUOTES', 'CONVERTED']].sum()
+        existing = pd.DataFrame({'QUOTES': totals[key]['QUOTES'], 'CONVERTED': totals[key]['CONVERTED']},
+                                index=pd.Index(totals[key]['VALUES'], dtype=object))
+        counts = existing.add(counts, fill_value=0).astype(int)
+        # Re-coded quotes can empty a key entirely
+        counts = counts[(counts != 0).any(axis=1)]
+        totals[key] = {'VALUES': counts.index.tolist(), 'QUOTES': counts['QUOTES'].tolist(),
+                       'CONVERTED': counts['CONVERTED'].tolist()}
+
+
+def rate_table(totals, key):
+    counts = pd.DataFrame({key: totals[key]['VALUES'], 'QUOTES': totals[key]['QUOTES'],
+                           'CONVERTED': totals[key]['CONVERTED']})
+    counts['CONVERSION_RATE'] = counts['CONVERTED'] / counts['QUOTES'].where(counts['QUOTES'] > 0)
+    return counts
+
+
 # Execute SQL queries and load data into pandas DataFrames
+state = load_state()
+watermark = state['watermark']
+settled_sid = int((datetime.now() - timedelta(days=SETTLE_DAYS)).strftime('%Y%m%d'))
+
 try:
-    quotes_df = pd.read_sql("SELECT QUOTE_SID, CUSTOMER_SID, DATE_CREATED_SID, EXPIRATION_DATE_SID, QUOTE_VALUE FROM F_SALES_QUOTES", engine)
-    sales_df = pd.read_sql("SELECT SALES_DOCUMENT_SID, BILL_CUSTOMER_SID, DOCUMENT_DATE_SID, EXTENDED_PRICE FROM F_SALES", engine)
-    customers_df = pd.read_sql("SELECT CUSTOMER_SID, CUSTOMER_CODE FROM D_SALES_DOCUMENTS", engine)
+    with stageProfiler.span('fetch', 'quotes and sales'):
+        customers = dimensionStore.load_dimension(engine, 'customers')
+        # Bound this run by the current high-water mark so lines arriving mid-run are picked up next time
+        high_watermark = int(pd.read_sql("SELECT COALESCE(MAX(SALES_DOCUMENT_LINE_SID), 0) as MAX_SID FROM F_SALES",
+                                         engine)['MAX_SID'].iloc[0])
+        last_quote_sid = state['last_quote_sid']
+        new_quotes = pd.read_sql(
+            text("SELECT QUOTE_SID, CUSTOMER_SID, DATE_CREATED_SID, EXPIRATION_DATE_SID, QUOTE_VALUE "
+                 "FROM F_SALES_QUOTES WHERE QUOTE_SID > :last_quote_sid"),
+            engine, params={'last_quote_sid': last_quote_sid})
+        new_quotes['CUSTOMER_CODE'] = dimensionStore.lookup(customers, 'CUSTOMER_CODE', new_quotes['CUSTOMER_SID'])
+
+        # New quotes are checked against every line already loaded inside their windows
+        if len(new_quotes):
+            new_sales = fetch_sales(engine, customers, """
+                SELECT BILL_CUSTOMER_SID, DOCUMENT_DATE_SID, EXTENDED_PRICE FROM F_SALES
+                WHERE DOCUMENT_DATE_SID BETWEEN :start_sid AND :end_sid
+                  AND SALES_DOCUMENT_LINE_SID <= :high_watermark
+                """, {'start_sid': int(new_quotes['DATE_CREATED_SID'].min()),
+                      'end_sid': int(new_quotes['EXPIRATION_DATE_SID'].max()),
+                      'high_watermark': high_watermark})
+        else:
+            new_sales = pd.DataFrame(columns=['BILL_CUSTOMER_SID', 'DOCUMENT_DATE_SID', 'EXTENDED_PRICE', 'CUSTOMER_CODE'])
+
+        # Quotes still open from earlier runs only need the lines that arrived since the last run
+        # Re-resolve codes every run: a customer without a D_SALES_DOCUMENTS row yet may have one now
+        open_quotes = state['open'].copy()
+        open_quotes['CUSTOMER_CODE'] = dimensionStore.lookup(customers, 'CUSTOMER_CODE', open_quotes['CUSTOMER_SID'])
+        recoded = (open_quotes['CUSTOMER_CODE'].fillna('UNKNOWN') != state['open']['CUSTOMER_CODE'].fillna('UNKNOWN'))
+        if len(open_quotes):
+            arrived_sales = fetch_sales(engine, customers, """
+                SELECT BILL_CUSTOMER_SID, DOCUMENT_DATE_SID, EXTENDED_PRICE FROM F_SALES
+                WHERE SALES_DOCUMENT_LINE_SID > :watermark
+                  AND SALES_DOCUMENT_LINE_SID <= :high_watermark
+                  AND DOCUMENT_DATE_SID >= :start_sid
+                """, {'watermark': watermark, 'high_watermark': high_watermark,
+                      'start_sid': int(open_quotes['DATE_CREATED_SID'].min())})
+        else:
+            arrived_sales = new_sales.iloc[0:0]
 except Exception as e:
     print(f"Error executing SQL queries: {e}")
     sys.exit(1)
 
-# Merge customer data with quotes and sales
-quotes_df = quotes_df.merge(customers_df, on='CUSTOMER_SID', how='left')
-sales_df = sales_df.merge(customers_df, left_on='BILL_CUSTOMER_SID', right_on='CUSTOMER_SID', how='left')
-
-# Convert date SIDs to datetime
-quotes_df['QUOTE_DATE'] = pd.to_datetime(quotes_df['DATE_CREATED_SID'], format='%Y%m%d')
-quotes_df['EXPIRATION_DATE'] = pd.to_datetime(quotes_df['EXPIRATION_DATE_SID'], format='%Y%m%d')
-sales_df['SALE_DATE'] = pd.to_datetime(sales_df['DOCUMENT_DATE_SID'], format='%Y%m%d')
-
-# Function to match quotes with sales
-def match_quote_to_sale(row, sales_df):
-    customer_sales = sales_df[sales_df['CUSTOMER_CODE'] == row['CUSTOMER_CODE']]
-    matching_sales = customer_sales[
-        (customer_sales['SALE_DATE'] >= row['QUOTE_DATE']) &
-        (customer_sales['SALE_DATE'] <= row['EXPIRATION_DATE']) &
-        (customer_sales['EXTENDED_PRICE'] == row['QUOTE_VALUE'])
-    ]
-    return len(matching_sales) > 0
-
-# Apply matching function
-quotes_df['CONVERTED'] = quotes_df.apply(lambda row: match_quote_to_sale(row, sales_df), axis=1)
+print(f"Evaluating {len(new_quotes)} new and {len(open_quotes)} open quotes "
+      f"({sum(state['totals']['QUOTE_MONTH']['QUOTES']) - len(open_quotes)} settled quotes skipped)")
+
+# Match quotes with sales
+with stageProfiler.span('transform', 'quote matching'):
+    new_quotes['CONVERTED'] = find_conversions(new_quotes, new_sales)
+    newly_converted = find_conversions(open_quotes, arrived_sales)
+
+    quotes = open_quotes.copy()
+    quotes.loc[newly_converted[newly_converted].index, 'CONVERTED'] = True
+    new_quotes['CLOSED'] = False
+    quotes = pd.concat([quotes, new_quotes[STATE_COLUMNS]], ignore_index=True)
+    # Once the window has passed (plus the settle period) the result can no longer change
+    quotes['CONVERTED'] = quotes['CONVERTED'].astype(bool)
+    quotes['CLOSED'] = quotes['CONVERTED'] | (quotes['EXPIRATION_DATE_SID'] < settled_sid)
+
+# Fold this run's deltas into the running totals
+with stageProfiler.span('aggregate', 'conversion rates'):
+    delta = pd.concat([
+        new_quotes.assign(QUOTES=1, CONVERTED=new_quotes['CONVERTED'].astype(int)),
+        open_quotes[newly_converted].assign(QUOTES=0, CONVERTED=1),
+        # Quotes whose customer code resolved differently this run move to the new code in the totals
+        state['open'][recoded].assign(QUOTES=-1, CONVERTED=0),
+        open_quotes[recoded].assign(QUOTES=1, CONVERTED=0),
+    ], ignore_index=True)
+    delta = add_rate_keys(delta[['CUSTOMER_CODE', 'QUOTE_VALUE', 'DATE_CREATED_SID', 'QUOTES', 'CONVERTED']])
+    delta['CUSTOMER_CODE'] = delta['CUSTOMER_CODE'].fillna('UNKNOWN')
+
+    update_totals(state['totals'], delta)
+    customer_conversion = rate_table(state['totals'], 'CUSTOMER_CODE')
+    value_range_conversion = rate_table(state['totals'], 'VALUE_RANGE')
+    time_conversion = rate_table(state['totals'], 'QUOTE_MONTH')
 
 # Calculate conversion rate
-conversion_rate = quotes_df['CONVERTED'].mean()
+total_quotes = time_conversion['QUOTES'].sum()
+conversion_rate = time_conversion['CONVERTED'].sum() / total_quotes if total_quotes else float('nan')
 
 print(f"Overall quote conversion rate: {conversion_rate:.2%}")
-
-# Additional analysis code here...
-# (Include the analysis code from the previous response)
+print(f"Open quotes carried to the next run: {(~quotes['CLOSED']).sum()}")
 
 # Save results to CSV in the current directory
-customer_conversion.to_csv(os.path.join(current_dir, 'customer_conversion_rates.csv'), index=False)
-value_range_conversion.to_csv(os.path.join(current_dir, 'value_range_conversion_rates.csv'))
-time_conversion.to_csv(os.path.join(current_dir, 'time_conversion_rates.csv'), index=False)
-
-print("Analysis complete. Results saved in the 'Quote Efficacy' folder.")
\ No newline at end of file
+with stageProfiler.span('write', 'rate tables and state'):
+    outputWriter.write_frame(customer_conversion, CUSTOMER_RATES_PATH, 'customer_conversion_rates')
+    outputWriter.write_frame(value_range_conversion, VALUE_RANGE_RATES_PATH, 'value_range_conversion_rates')
+    outputWriter.write_frame(time_conversion, TIME_RATES_PATH, 'time_conversion_rates')
+    # The checkpoint is written last: a crash before it leaves the previous checkpoint in force
+    append_settled(state, quotes[quotes['CLOSED']])
+    state['open'] = quotes[~quotes['CLOSED']]
+    state['watermark'] = high_watermark
+    if len(new_quotes):
+        state['last_quote_sid'] = max(state['last_quote_sid'], int(new_quotes['QUOTE_SID'].max()))
+    save_state(state)
+
+print("Analysis complete. Results saved in the 'Quote Efficacy' folder.")
@@ -0,0 +1,148 @@
+import os
+import numpy as np
+import pandas as pd
+import outputWriter
+
+# Monthly cohort retention built with bincount.
+#
+# Each BILL_CUSTOMER_SID belongs to the cohort of its first ORDER_DATE_SID month. The state holds the
+# distinct (customer, month) pairs with their summed revenue; both matrices come from one bincount each
+# over those pairs, mapped to (cohort, months since first purchase) cells.
+#
+# update_cohorts folds in new lines as months arrive. Lines in a month already seen add to that pair's
+# revenue without counting the customer twice, and a late-posted line before a customer's first month
+# simply moves the customer to the earlier cohort, because cohorts are derived from the pairs on read.
+# Callers pass only lines not folded in before; a line passed twice has its revenue counted twice.
+#
+# The matrices are written as one long, typed cohort_retention output (one row per reached cell).
+# Heatmaps are optional: set EXPLORE_COHORT_HEATMAPS=1 to have Beach_Comber draw them.
+
+# Months are stored as ordinals (year * 12 + month - 1); pair keys pack SID and ordinal into one int64
+PAIR_MONTH_SPAN = 1 << 16
+
+HEATMAPS_ENABLED = os.environ.get('EXPLORE_COHORT_HEATMAPS', '') not in ('', '0')
+
+
+def date_sid_to_month(date_sids):
+    date_sids = np.asarray(date_sids, dtype=np.int64)
+    return (date_sids // 10000) * 12 + (date_sids // 100 % 100 - 1)
+
+
+def month_label(ordinals):
+    ordinals = np.asarray(ordinals, dtype=np.int64)
+    return (ordinals // 12) * 100 + ordinals % 12 + 1
+
+
+def empty_state():
+    return {
+        'customers': np.empty(0, dtype=np.int64),
+        'first_month': np.empty(0, dtype=np.int64),
+        'pair_keys': np.empty(0, dtype=np.int64),
+        'pair_revenue': np.empty(0, dtype=np.float64),
+    }
+
+
+def update_cohorts(state, customers, date_sids, revenue):
+    customers = np.asarray(customers, dtype=np.int64)
+    months = date_sid_to_month(date_sids)
+    revenue = np.asarray(revenue, dtype=np.float64)
+    if len(customers) == 0:
+        return state
+
+    # Merge the batch's (customer, month) revenue into the pairs already held
+    keys = np.concatenate([state['pair_keys'], customers * PAIR_MONTH_SPAN + months])
+    weights = np.concatenate([state['pair_revenue'], revenue])
+    pair_keys, inverse = np.unique(keys, return_inverse=True)
+    state['pair_keys'] = pair_keys
+    state['pair_revenue'] = np.bincount(inverse, weights=weights, minlength=len(pair_keys))
+
+    # Keys sort by customer, then month, so each customer's first pair holds its first month
+    pair_customers = pair_keys // PAIR_MONTH_SPAN
+    starts = np.flatnonzero(np.r_[True, pair_customers[1:] != pair_customers[:-1]])
+    state['customers'] = pair_customers[starts]
+    state['first_month'] = pair_keys[starts] % PAIR_MONTH_SPAN
+    return state
+
+
+def build_cohorts(customers, date_sids, revenue):
+    return update_cohorts(empty_state(), customers, date_sids, revenue)
+
+
+def cohort_of(state, customers):
+    # First-purchase month (YYYYMM) per customer; 0 for customers without purchases
+    customers = np.asarray(customers, dtype=np.float64)
+    result = np.zeros(len(customers), dtype=np.int64)
+    valid = np.isfinite(customers)
+    sids = customers[valid].astype(np.int64)
+    positions = np.minimum(np.searchsorted(state['customers'], sids), max(len(state['customers']) - 1, 0))
+    found = np.zeros(len(sids), dtype=bool)
+    if len(state['customers']):
+        found = state['customers'][positions] == sids
+    months = np.zeros(len(sids), dtype=np.int64)
+    months[found] = month_label(state['first_month'][positions[found]])
+    result[valid] = months
+    return result
+
+
+def retention_matrices(state):
+    # Cohort x months-since-first-purchase frames: active customers, revenue, and both as shares of month 0
+    pair_months = state['pair_keys'] % PAIR_MONTH_SPAN
+    first_month = state['first_month'][np.searchsorted(state['customers'], state['pair_keys'] // PAIR_MONTH_SPAN)]
+    base_month, last_month = int(state['first_month'].min()), int(pair_months.max())
+    cohorts = first_month - base_month
+    ages = pair_months - first_month
+    n_cohorts, n_ages = int(cohorts.max()) + 1, int(ages.max()) + 1
+    cells = cohorts * n_ages + ages
+    active_counts = np.bincount(cells, minlength=n_cohorts * n_ages).reshape(n_cohorts, n_ages)
+    revenue_sums = np.bincount(cells, weights=state['pair_revenue'], minlength=n_cohorts * n_ages).reshape(
+        n_cohorts, n_ages)
+
+    index = pd.Index(month_label(base_month + np.arange(n_cohorts)), name='COHORT')
+    columns = pd.Index(np.arange(n_ages), name='MONTHS_SINCE_FIRST_PURCHASE')
+    active = pd.DataFrame(active_counts, index=index, columns=columns)
+    revenue = pd.DataFrame(revenue_sums, index=index, columns=columns)
+
+    # Cells a cohort has not reached yet are NaN rather than 0% retention
+    latest_age = last_month - (base_month + np.arange(n_cohorts))
+    reached = np.arange(n_ages)[None, :] <= latest_age[:, None]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        retention = np.where(reached, active_counts / active_counts[:, :1], np.nan)
+        revenue_retention = np.where(reached, revenue_sums / revenue_sums[:, :1], np.nan)
+    return {
+        'active': active,
+        'revenue': revenue,
+        'retention': pd.DataFrame(retention, index=index, columns=columns),
+        'revenue_retention': pd.DataFrame(revenue_retention, index=index, columns=columns),
+    }
+
+
+def write_matrices(matrices, path_base='cohort_retention', formats=None):
+    # Long form: one row per (cohort, months since first purchase) cell the cohort has reached
+    active = matrices['active']
+    n_cohorts, n_ages = active.shape
+    cells = pd.DataFrame({
+        'COHORT': np.repeat(active.index.to_numpy(), n_ages),
+        'MONTHS_SINCE_FIRST_PURCHASE': np.tile(active.columns.to_numpy(), n_cohorts),
+        'ACTIVE_CUSTOMERS': active.to_numpy().ravel(),
+        'REVENUE': matrices['revenue'].to_numpy().ravel(),
+        'RETENTION': matrices['retention'].to_numpy().ravel(),
+        'REVENUE_RETENTION': matrices['revenue_retention'].to_numpy().ravel(),
+    })
+    # Unreached cells and months in which no cohort started have no retention share and are left out
+    cells = cells[cells['RETENTION'].notna()].reset_index(drop=True)
+    return outputWriter.write_frame(cells, path_base, 'cohort_retention', formats)
+
+
+def plot_heatmaps(matrices, output_dir='.', prefix='cohort'):
+    import matplotlib.pyplot as plt
+    import seaborn as sns
+
+    for name in ('retention', 'revenue_retention'):
+        plt.figure(figsize=(14, 8))
+        sns.heatmap(matrices[name], cmap='YlGnBu', vmin=0, vmax=1)
+        plt.title(f"Cohort {name.replace('_', ' ').title()}")
+        plt.xlabel('Months Since First Purchase')
+        plt.ylabel('First Purchase Month')
+        plt.tight_layout()
+        plt.savefig(os.path.join(output_dir, f'{prefix}_{name}.png'))
+        plt.close()
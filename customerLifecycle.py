@@ -0,0 +1,252 @@
+import os
+import numpy as np
+import pandas as pd
+from sqlalchemy import create_engine
+import configparser
+from datetime import datetime
+import stageProfiler
+import outputWriter
+
+# Customer lifecycle and churn metrics (customer_lifecycle_analysis / customer_churn_analysis).
+#
+# Lines are sorted once by (BILL_CUSTOMER_SID, order day) and every per-customer metric is a segmented
+# reduction over the customer boundaries (np.diff + ufunc.reduceat), so there is no per-customer loop.
+# To stay inside MEMORY_BUDGET_BYTES, F_SALES is processed in BILL_CUSTOMER_SID ranges sized from the
+# per-customer line counts; a customer never spans two ranges, so each range is reduced independently.
+# Each range is read in pages of about READ_PAGE_LINES lines, because pd.read_sql materialises rows as
+# Python objects first; only one page's read cost is reserved out of the budget. The pages are copied
+# into arrays preallocated from the line counts, and reduce_lifecycle consumes those arrays, dropping each
+# input as soon as its sorted copy exists.
+# Pages select by BILL_CUSTOMER_SID, so F_SALES needs an index on it; without one every page is a full
+# table scan. A covering index keeps the reads off the table rows entirely:
+#   CREATE INDEX IX_F_SALES_BILL_CUSTOMER ON F_SALES (BILL_CUSTOMER_SID, ORDER_DATE_SID, EXTENDED_PRICE)
+# Inter-purchase gaps are collected in a day histogram, which keeps the percentiles exact in fixed memory.
+
+MEMORY_BUDGET_BYTES = int(os.environ.get('EXPLORE_LIFECYCLE_MEMORY_BYTES', 1024 ** 3))
+# Measured peak of a range: per line, the three input arrays plus the sort permutation and one sorted copy
+# while reduce_lifecycle swaps them in; per customer, the lifecycle and churn frames and their Arrow
+# conversion on write (about 135 bytes measured)
+BYTES_PER_LINE = 56
+BYTES_PER_CUSTOMER = 144
+# Peak pd.read_sql cost for the three columns (about 300 bytes per line measured) and the page it applies to
+READ_BYTES_PER_LINE = 320
+READ_PAGE_LINES = 200000
+
+CHURN_THRESHOLD_DAYS = 90
+GAP_PERCENTILES = [50, 75, 90, 95, 99]
+MAX_GAP_DAYS = 365 * 100
+
+# The outputs are shipped as CSV, so keep CSV alongside Parquet unless formats are set explicitly
+OUTPUT_FORMATS = os.environ.get('EXPLORE_OUTPUT_FORMATS', 'parquet,csv')
+
+
+def read_config(config_path='config.ini'):
+    config = configparser.ConfigParser()
+    config.read(config_path)
+    return config['mysql']
+
+
+def create_db_engine(db_config):
+    return create_engine(
+        f"mysql+mysqlconnector://{db_config['user']}:{db_config['password']}@{db_config['host']}/{db_config['database']}")
+
+
+def date_sid_to_days(date_sids):
+    # YYYYMMDD integers to datetime64[D] without going through strings
+    date_sids = np.asarray(date_sids, dtype=np.int64)
+    years, months, days = date_sids // 10000, date_sids // 100 % 100, date_sids % 100
+    month_starts = ((years - 1970) * 12 + months - 1).astype('datetime64[M]')
+    return month_starts.astype('datetime64[D]') + (days - 1)
+
+
+def plan_customer_ranges(line_counts, max_cost, line_cost=1, customer_cost=0):
+    # Greedy (first SID, last SID) ranges costing at most max_cost, where a customer costs customer_cost plus
+    # line_cost per line (by default max_cost is a line count); a larger customer gets its own range.
+    # Each range end is one searchsorted over the cumulative costs, so this loops per range, not per customer
+    sids = line_counts['BILL_CUSTOMER_SID'].to_numpy(dtype=np.int64)
+    cumulative = np.cumsum(line_counts['LINE_COUNT'].to_numpy(dtype=np.int64) * line_cost + customer_cost)
+    ranges, start = [], 0
+    while start < len(sids):
+        consumed = cumulative[start - 1] if start else 0
+        end = max(int(np.searchsorted(cumulative, consumed + max_cost, side='right')), start + 1)
+        ranges.append((int(sids[start]), int(sids[end - 1])))
+        start = end
+    return ranges
+
+
+def reduce_lifecycle(lines):
+    # Sort once, then reduce each customer segment; returns the per-customer frame and a gap-day histogram.
+    # lines is [customers, days, spend] and is emptied, so each input is freed once its sorted copy exists.
+    order = np.lexsort((lines[1], lines[0]))
+    customers = lines[0][order]
+    lines[0] = None
+    days = lines[1][order]
+    lines[1] = None
+    spend = lines[2][order]
+    lines.clear()
+    del order
+
+    starts = np.flatnonzero(np.r_[True, customers[1:] != customers[:-1]])
+    counts = np.diff(np.r_[starts, len(customers)])
+    first = days[starts]
+    last = days[np.r_[starts[1:], len(customers)] - 1]
+    lifetime = (last - first).astype(np.int64)
+
+    lifecycle = pd.DataFrame({
+        'BILL_CUSTOMER_SID': customers[starts],
+        'FIRST_PURCHASE': first,
+        'LAST_PURCHASE': last,
+        'PURCHASE_COUNT': counts,
+        'TOTAL_SPEND': np.add.reduceat(spend, starts),
+        'CUSTOMER_LIFETIME_DAYS': lifetime,
+        # Same definition as the shipped customer_lifecycle_analysis.csv: lifetime over line count
+        'AVG_DAYS_BETWEEN_PURCHASES': lifetime / counts,
+    })
+
+    # Gaps between distinct purchase days of the same customer
+    steps = np.diff(days).astype(np.int64)
+    gaps = steps[(customers[1:] == customers[:-1]) & (steps > 0)]
+    gap_histogram = np.bincount(np.minimum(gaps, MAX_GAP_DAYS), minlength=MAX_GAP_DAYS + 1)
+    return lifecycle, gap_histogram
+
+
+def churn_from_lifecycle(lifecycle, as_of, threshold_days=CHURN_THRESHOLD_DAYS):
+    days_since = (np.datetime64(as_of, 'D') - lifecycle['LAST_PURCHASE'].to_numpy().astype('datetime64[D]'))
+    days_since = days_since.astype(np.int64)
+    return pd.DataFrame({
+        'BILL_CUSTOMER_SID': lifecycle['BILL_CUSTOMER_SID'].to_numpy(),
+        'ORDER_DATE': lifecycle['LAST_PURCHASE'].to_numpy(),
+        'DAYS_SINCE_LAST_PURCHASE': days_since,
+        'EXTENDED_PRICE': lifecycle['TOTAL_SPEND'].to_numpy(),
+        'IS_CHURNED': days_since > threshold_days,
+    })
+
+
+def gap_percentiles(gap_histogram, percentiles=GAP_PERCENTILES):
+    total = gap_histogram.sum()
+    if total == 0:
+        return {p: None for p in percentiles}
+    cumulative = np.cumsum(gap_histogram)
+    # Nearest-rank percentile straight from the histogram
+    ranks = np.ceil(np.asarray(percentiles) / 100 * total).astype(np.int64)
+    return {p: int(np.searchsorted(cumulative, max(rank, 1))) for p, rank in zip(percentiles, ranks)}
+
+
+def lifecycle_from_frame(df, as_of=None):
+    # In-memory path for a sales extract such as f_sales_sample.csv
+    df = df.dropna(subset=['BILL_CUSTOMER_SID', 'ORDER_DATE_SID'])
+    lifecycle, gap_histogram = reduce_lifecycle([df['BILL_CUSTOMER_SID'].to_numpy(dtype=np.int64),
+                                                 date_sid_to_days(df['ORDER_DATE_SID']),
+                                                 df['EXTENDED_PRICE'].fillna(0).to_numpy(dtype=np.float64)])
+    churn = churn_from_lifecycle(lifecycle, as_of or datetime.now().date())
+    return lifecycle, churn, gap_percentiles(gap_histogram)
+
+
+def fetch_line_counts(connectable):
+    query = """
+    SELECT
+        BILL_CUSTOMER_SID,
+        COUNT(*) as LINE_COUNT
+    FROM
+        F_SALES
+    WHERE
+        BILL_CUSTOMER_SID IS NOT NULL AND ORDER_DATE_SID IS NOT NULL
+    GROUP BY
+        BILL_CUSTOMER_SID
+    ORDER BY
+        BILL_CUSTOMER_SID
+    """
+    return pd.read_sql(query, connectable)
+
+
+def fetch_customer_range(connectable, first_sid, last_sid):
+    query = f"""
+    SELECT
+        BILL_CUSTOMER_SID,
+        ORDER_DATE_SID,
+        EXTENDED_PRICE
+    FROM
+        F_SALES
+    WHERE
+        BILL_CUSTOMER_SID BETWEEN {int(first_sid)} AND {int(last_sid)}
+        AND ORDER_DATE_SID IS NOT NULL
+    """
+    return pd.read_sql(query, connectable)
+
+
+def read_customer_range(connectable, line_counts, first_sid, last_sid, page_lines=READ_PAGE_LINES):
+    # One range as [customers, days, spend] arrays for reduce_lifecycle, fetched page by page so only one
+    # page of DB rows is held as Python objects; pages are copied into arrays sized from the line counts
+    sids = line_counts['BILL_CUSTOMER_SID'].to_numpy(dtype=np.int64)
+    in_range = line_counts[(sids >= first_sid) & (sids <= last_sid)]
+    size = int(in_range['LINE_COUNT'].sum())
+    customers = np.empty(size, dtype=np.int64)
+    days = np.empty(size, dtype='datetime64[D]')
+    spend = np.empty(size, dtype=np.float64)
+    filled = 0
+    for page_first, page_last in plan_customer_ranges(in_range, page_lines):
+        page = fetch_customer_range(connectable, page_first, page_last)
+        end = filled + len(page)
+        if end > len(customers):
+            # Lines inserted since the counts were taken
+            customers, days, spend = (np.resize(a, end) for a in (customers, days, spend))
+        customers[filled:end] = page['BILL_CUSTOMER_SID'].to_numpy(dtype=np.int64)
+        days[filled:end] = date_sid_to_days(page['ORDER_DATE_SID'])
+        spend[filled:end] = page['EXTENDED_PRICE'].fillna(0).to_numpy(dtype=np.float64)
+        filled = end
+        del page
+    return [customers[:filled], days[:filled], spend[:filled]]
+
+
+def run_lifecycle(connectable, output_dir='.', as_of=None, memory_budget=MEMORY_BUDGET_BYTES):
+    as_of = as_of or datetime.now().date()
+    with stageProfiler.span('fetch', 'line counts per customer'):
+        line_counts = fetch_line_counts(connectable)
+    # Reserve one page's read cost; the rest holds the arrays and frames of a range
+    array_budget = memory_budget - READ_PAGE_LINES * READ_BYTES_PER_LINE
+    ranges = plan_customer_ranges(line_counts, max(array_budget, READ_PAGE_LINES * BYTES_PER_LINE),
+                                  BYTES_PER_LINE, BYTES_PER_CUSTOMER)
+    print(f"Processing {int(line_counts['LINE_COUNT'].sum())} lines for {len(line_counts)} customers "
+          f"in {len(ranges)} batches")
+
+    gap_histogram = np.zeros(MAX_GAP_DAYS + 1, dtype=np.int64)
+    churned = 0
+    with outputWriter.open_writer(os.path.join(output_dir, 'customer_lifecycle_analysis'),
+                                  'customer_lifecycle_analysis', OUTPUT_FORMATS) as lifecycle_writer, \
+            outputWriter.open_writer(os.path.join(output_dir, 'customer_churn_analysis'),
+                                     'customer_churn_analysis', OUTPUT_FORMATS) as churn_writer:
+        for first_sid, last_sid in ranges:
+            with stageProfiler.span('fetch', f'F_SALES customers {first_sid}-{last_sid}'):
+                lines = read_customer_range(connectable, line_counts, first_sid, last_sid)
+            with stageProfiler.span('aggregate', 'lifecycle reduction'):
+                lifecycle, histogram = reduce_lifecycle(lines)
+                churn = churn_from_lifecycle(lifecycle, as_of)
+                gap_histogram += histogram
+                churned += int(churn['IS_CHURNED'].sum())
+            with stageProfiler.span('write', 'lifecycle batch'):
+                lifecycle_writer.write(lifecycle)
+                churn_writer.write(churn)
+
+    percentiles = gap_percentiles(gap_histogram)
+    with stageProfiler.span('write', 'gap percentiles'):
+        outputWriter.write_frame(
+            pd.DataFrame({'PERCENTILE': list(percentiles), 'GAP_DAYS': list(percentiles.values())}),
+            os.path.join(output_dir, 'inter_purchase_gap_percentiles'), 'inter_purchase_gap_percentiles',
+            OUTPUT_FORMATS)
+
+    print(f"Churned customers (> {CHURN_THRESHOLD_DAYS} days since last purchase): {churned}")
+    print("Inter-purchase gap percentiles (days):")
+    for p, gap in percentiles.items():
+        print(f"  p{p}: {gap}")
+    return percentiles
+
+
+def main():
+    db_config = read_config()
+    engine = create_db_engine(db_config)
+    run_lifecycle(engine)
+    print("\nLifecycle analysis complete. Results saved to customer_lifecycle_analysis and customer_churn_analysis.")
+
+
+if __name__ == "__main__":
+    main()
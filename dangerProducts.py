@@ -3,6 +3,7 @@ from mysql.connector import Error
 import configparser
 from decimal import Decimal
 from datetime import datetime, timedelta
+import stageProfiler
 
 
 def read_config(config_path='config.ini'):
@@ -132,14 +133,16 @@ def main():
         date_ranges = get_date_ranges(months=12)  # Analyze last 12 months
         print(f"\nAnalyzing data from {date_ranges['start_date']} to {date_ranges['end_date']}")
 
-        sales_data = get_sales_data(connection, date_ranges)
+        with stageProfiler.span('fetch', 'sales summary'):
+            sales_data = get_sales_data(connection, date_ranges)
         if sales_data:
             print("\nSales Data Summary:")
             print(f"Date Range: {sales_data[0]['MIN_DATE']} to {sales_data[0]['MAX_DATE']}")
             print(f"Total Records: {sales_data[0]['TOTAL_RECORDS']}")
             print(f"Distinct Items: {sales_data[0]['DISTINCT_ITEMS']}")
 
-        at_risk_products = get_products_in_danger(connection, date_ranges, threshold=0.7, limit=50)
+        with stageProfiler.span('aggregate', 'products in danger'):
+            at_risk_products = get_products_in_danger(connection, date_ranges, threshold=0.7, limit=50)
 
         if at_risk_products:
             print("\nProducts Potentially at Risk:")
@@ -0,0 +1,170 @@
+import os
+import json
+import numpy as np
+import pandas as pd
+
+# Cached dimension tables kept as columnar NumPy arrays with a dense SID -> row index.
+# Fact-side code resolves attributes with vectorized gathers instead of SQL joins or pandas merges.
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'dimension_cache')
+
+DIMENSIONS = {
+    'items': {
+        'table': 'D_ITEMS',
+        'key': 'ITEM_SID',
+        'columns': ['ITEM_NUMBER', 'ITEM_DESCRIPTION', 'STANDARD_COST_AMOUNT'],
+    },
+    'customers': {
+        # D_SALES_DOCUMENTS repeats each customer once per document, so collapse it to one row per SID
+        'table': 'D_SALES_DOCUMENTS',
+        'key': 'CUSTOMER_SID',
+        'columns': ['CUSTOMER_CODE'],
+        'group_by_key': True,
+    },
+}
+
+
+def _fingerprint_query(spec):
+    # The checksum covers the cached columns, so in-place updates that keep the row count and SID span
+    # (a new STANDARD_COST_AMOUNT, a renamed ITEM_NUMBER) still invalidate the cache
+    columns = ', '.join([spec['key']] + spec['columns'])
+    return f"""
+    SELECT
+        COUNT(*) as ROW_COUNT,
+        MIN({spec['key']}) as MIN_SID,
+        MAX({spec['key']}) as MAX_SID,
+        SUM(CRC32(CONCAT_WS('|', {columns}))) as CONTENT_CHECKSUM
+    FROM
+        {spec['table']}
+    """
+
+
+def _load_query(spec):
+    if spec.get('group_by_key'):
+        columns = ', '.join(f"MAX({col}) as {col}" for col in spec['columns'])
+        return f"SELECT {spec['key']}, {columns} FROM {spec['table']} GROUP BY {spec['key']}"
+    return f"SELECT {spec['key']}, {', '.join(spec['columns'])} FROM {spec['table']}"
+
+
+def fetch_fingerprint(connectable, name):
+    spec = DIMENSIONS[name]
+    row = pd.read_sql(_fingerprint_query(spec), connectable).iloc[0]
+    # Stringify so the fingerprint round-trips through JSON unchanged
+    return {col: (None if pd.isna(row[col]) else str(row[col])) for col in row.index}
+
+
+def build_dimension(df, key, columns, fingerprint=None):
+    df = df.dropna(subset=[key])
+    sids = df[key].to_numpy(dtype=np.int64)
+
+    if len(sids):
+        offset = int(sids.min())
+        index = np.full(int(sids.max()) - offset + 1, -1, dtype=np.int64)
+        # Later rows win when a SID appears more than once
+        index[sids - offset] = np.arange(len(sids), dtype=np.int64)
+    else:
+        offset = 0
+        index = np.empty(0, dtype=np.int64)
+
+    arrays = {}
+    for col in columns:
+        values = df[col]
+        if pd.api.types.is_numeric_dtype(values):
+            arrays[col] = values.to_numpy(dtype=np.float64)
+        else:
+            # Fixed-width unicode keeps the .npz cache loadable without pickle
+            arrays[col] = values.fillna('').astype(str).to_numpy().astype(str)
+
+    return {
+        'key': key,
+        'offset': offset,
+        'index': index,
+        'columns': arrays,
+        'fingerprint': fingerprint,
+    }
+
+
+def _cache_path(cache_dir, name):
+    return os.path.join(cache_dir, f'{name}.npz')
+
+
+def save_dimension(dimension, path):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    meta = {
+        'key': dimension['key'],
+        'offset': dimension['offset'],
+        'columns': list(dimension['columns']),
+        'fingerprint': dimension['fingerprint'],
+    }
+    arrays = {f'col_{i}': values for i, values in enumerate(dimension['columns'].values())}
+    tmp_path = path + '.tmp.npz'
+    np.savez(tmp_path, meta=np.array(json.dumps(meta)), index=dimension['index'], **arrays)
+    os.replace(tmp_path, path)
+
+
+def read_cached_dimension(path):
+    if not os.path.exists(path):
+        return None
+    try:
+        with np.load(path) as data:
+            meta = json.loads(str(data['meta']))
+            return {
+                'key': meta['key'],
+                'offset': meta['offset'],
+                'index': data['index'],
+                'columns': {col: data[f'col_{i}'] for i, col in enumerate(meta['columns'])},
+                'fingerprint': meta['fingerprint'],
+            }
+    except (OSError, KeyError, ValueError) as e:
+        print(f"Ignoring unreadable dimension cache {path}: {e}")
+        return None
+
+
+def load_dimension(connectable, name, cache_dir=DEFAULT_CACHE_DIR, refresh=False):
+    spec = DIMENSIONS[name]
+    path = _cache_path(cache_dir, name)
+    fingerprint = fetch_fingerprint(connectable, name)
+
+    cached = None if refresh else read_cached_dimension(path)
+    if (cached is not None and cached['fingerprint'] == fingerprint
+            and list(cached['columns']) == spec['columns']):
+        return cached
+
+    # Source changed (or no cache yet): reload the whole dimension once and refresh the cache
+    df = pd.read_sql(_load_query(spec), connectable)
+    dimension = build_dimension(df, spec['key'], spec['columns'], fingerprint)
+    save_dimension(dimension, path)
+    print(f"Refreshed {spec['table']} dimension cache ({len(df)} rows)")
+    return dimension
+
+
+def resolve_rows(dimension, sids):
+    # Row position of each SID in the dimension arrays, -1 where the SID is unknown or null
+    sids = np.asarray(sids, dtype=np.float64)
+    index = dimension['index']
+    rows = np.full(sids.shape, -1, dtype=np.int64)
+
+    valid = np.isfinite(sids)
+    positions = np.where(valid, sids, dimension['offset']).astype(np.int64) - dimension['offset']
+    valid &= (positions >= 0) & (positions < len(index))
+    rows[valid] = index[positions[valid]]
+    return rows
+
+
+def lookup(dimension, column, sids, rows=None):
+    if rows is None:
+        rows = resolve_rows(dimension, sids)
+    values = dimension['columns'][column]
+    missing = rows < 0
+    if len(values) == 0:
+        rows = np.zeros_like(rows)
+        values = np.zeros(1, dtype=values.dtype)
+
+    gathered = values[np.where(missing, 0, rows)]
+    if gathered.dtype.kind == 'f':
+        gathered[missing] = np.nan
+    else:
+        # Match a left merge: unknown keys come back as None rather than ''
+        gathered = gathered.astype(object)
+        gathered[missing] = None
+    return gathered
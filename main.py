@@ -2,6 +2,7 @@ import mysql.connector
 from mysql.connector import Error
 import configparser
 import os
+import stageProfiler
 
 
 def read_config(config_path='config.ini'):
@@ -93,7 +94,8 @@ def main():
     db_config = read_config()
     connection = connect_to_database(db_config)
     if connection:
-        explore_schema(connection, db_config['database'])
+        with stageProfiler.span('fetch', 'schema metadata'):
+            explore_schema(connection, db_config['database'])
         connection.close()
         print("\nMySQL connection closed")
 
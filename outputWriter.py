@@ -0,0 +1,198 @@
+import os
+
+try:
+    import pyarrow as pa
+    import pyarrow.ipc
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+import pandas as pd
+
+# Typed, streaming writers for the analysis outputs.
+#
+#   with outputWriter.open_writer('tail_customers_churn_risk', 'tail_customers_churn_risk') as writer:
+#       writer.write(chunk)   # any number of times, as results are produced
+#
+# Every output has a fixed Arrow schema in SCHEMAS so its column types do not drift with the data.
+# Formats come from EXPLORE_OUTPUT_FORMATS (comma separated, default "parquet"):
+#   parquet  compressed Parquet written in row groups
+#   arrow    Arrow IPC file (Feather v2); uncompressed unless EXPLORE_ARROW_COMPRESSION is set,
+#            so downstream jobs can memory-map it with pyarrow.ipc.open_file(pa.memory_map(path))
+#   csv      plain CSV for older consumers
+# Without pyarrow installed, every output falls back to CSV.
+
+DEFAULT_FORMATS = os.environ.get('EXPLORE_OUTPUT_FORMATS', 'parquet')
+PARQUET_COMPRESSION = os.environ.get('EXPLORE_PARQUET_COMPRESSION', 'zstd')
+ARROW_COMPRESSION = os.environ.get('EXPLORE_ARROW_COMPRESSION') or None
+ROW_GROUP_SIZE = 128 * 1024
+
+EXTENSIONS = {'parquet': '.parquet', 'arrow': '.arrow', 'csv': '.csv'}
+
+
+def _schemas():
+    rate_columns = [('QUOTES', pa.int64()), ('CONVERTED', pa.int64()), ('CONVERSION_RATE', pa.float64())]
+    return {
+        'tail_customers_churn_risk': pa.schema([
+            ('BILL_CUSTOMER_SID', pa.int64()),
+            ('REVENUE', pa.float64()),
+            ('PROFIT', pa.float64()),
+            ('ORDER_DATE', pa.timestamp('us')),
+            ('CUM_REVENUE_PERCENT', pa.float64()),
+            ('SEGMENT', pa.string()),
+            ('RECENCY', pa.int64()),
+            ('FREQUENCY', pa.float64()),
+            ('MONETARY', pa.float64()),
+            ('RECENCY_RISK', pa.bool_()),
+            ('FREQUENCY_RISK', pa.bool_()),
+            ('MONETARY_RISK', pa.bool_()),
+            ('CHURN_RISK_SCORE', pa.int64()),
+            ('RECENCY_NORM', pa.float64()),
+            ('FREQUENCY_NORM', pa.float64()),
+            ('MONETARY_NORM', pa.float64()),
+            ('COHORT_MONTH', pa.int64()),
+        ]),
+        'kmeans_segmentation': pa.schema([
+            ('CUSTOMER_ID', pa.int64()),
+            ('TOTAL_REVENUE', pa.float64()),
+            ('CLUSTER', pa.int32()),
+            ('SEGMENT', pa.string()),
+        ]),
+        'customer_lifecycle_analysis': pa.schema([
+            ('BILL_CUSTOMER_SID', pa.int64()),
+            ('FIRST_PURCHASE', pa.date32()),
+            ('LAST_PURCHASE', pa.date32()),
+            ('PURCHASE_COUNT', pa.int64()),
+            ('TOTAL_SPEND', pa.float64()),
+            ('CUSTOMER_LIFETIME_DAYS', pa.int64()),
+            ('AVG_DAYS_BETWEEN_PURCHASES', pa.float64()),
+        ]),
+        'customer_churn_analysis': pa.schema([
+            ('BILL_CUSTOMER_SID', pa.int64()),
+            ('ORDER_DATE', pa.date32()),
+            ('DAYS_SINCE_LAST_PURCHASE', pa.int64()),
+            ('EXTENDED_PRICE', pa.float64()),
+            ('IS_CHURNED', pa.bool_()),
+        ]),
+        'inter_purchase_gap_percentiles': pa.schema([
+            ('PERCENTILE', pa.int64()),
+            ('GAP_DAYS', pa.int64()),
+        ]),
+        'cohort_retention': pa.schema([
+            ('COHORT', pa.int64()),
+            ('MONTHS_SINCE_FIRST_PURCHASE', pa.int64()),
+            ('ACTIVE_CUSTOMERS', pa.int64()),
+            ('REVENUE', pa.float64()),
+            ('RETENTION', pa.float64()),
+            ('REVENUE_RETENTION', pa.float64()),
+        ]),
+        'customer_conversion_rates': pa.schema([('CUSTOMER_CODE', pa.string())] + rate_columns),
+        'value_range_conversion_rates': pa.schema([('VALUE_RANGE', pa.string())] + rate_columns),
+        'time_conversion_rates': pa.schema([('QUOTE_MONTH', pa.string())] + rate_columns),
+    }
+
+
+SCHEMAS = _schemas() if pa is not None else {}
+
+
+def output_formats(formats=None):
+    formats = formats or DEFAULT_FORMATS
+    if isinstance(formats, str):
+        formats = [f.strip() for f in formats.split(',') if f.strip()]
+    unknown = set(formats) - set(EXTENSIONS)
+    if unknown:
+        raise ValueError(f"Unknown output formats: {sorted(unknown)}")
+    if pa is None and set(formats) - {'csv'}:
+        print("pyarrow is not installed; writing CSV output only")
+        return ['csv']
+    return list(formats)
+
+
+class OutputWriter:
+    # Buffers incoming frames into row groups and streams them to every requested format
+
+    def __init__(self, path_base, schema_name, formats=None, row_group_size=ROW_GROUP_SIZE):
+        self.path_base = path_base
+        self.formats = output_formats(formats)
+        self.schema = SCHEMAS.get(schema_name)
+        self.row_group_size = row_group_size
+        self.paths = {fmt: path_base + EXTENSIONS[fmt] for fmt in self.formats}
+        self.rows_written = 0
+        self._pending = []
+        self._pending_rows = 0
+        self._parquet = None
+        self._arrow = None
+        self._csv_started = False
+
+        directory = os.path.dirname(path_base)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        if 'parquet' in self.formats:
+            self._parquet = pq.ParquetWriter(self.paths['parquet'], self.schema, compression=PARQUET_COMPRESSION)
+        if 'arrow' in self.formats:
+            options = pa.ipc.IpcWriteOptions(compression=ARROW_COMPRESSION)
+            self._arrow = pa.ipc.new_file(self.paths['arrow'], self.schema, options=options)
+
+    def _to_table(self, df):
+        return pa.Table.from_pandas(df[self.schema.names], schema=self.schema, preserve_index=False)
+
+    def write(self, df):
+        if df.empty:
+            return
+        # Check the chunk before any format is written so a bad chunk leaves no partial output
+        if self.schema is not None:
+            missing = [name for name in self.schema.names if name not in df.columns]
+            if missing:
+                raise ValueError(f"Output {self.path_base} is missing columns {missing}")
+        if 'csv' in self.formats:
+            columns = self.schema.names if self.schema is not None else df.columns
+            df.to_csv(self.paths['csv'], columns=columns, index=False,
+                      mode='a' if self._csv_started else 'w', header=not self._csv_started)
+            self._csv_started = True
+        if self._parquet is not None or self._arrow is not None:
+            # Convert now so schema errors surface at the chunk that caused them
+            self._pending.append(self._to_table(df))
+            self._pending_rows += len(df)
+            if self._pending_rows >= self.row_group_size:
+                self._flush()
+        self.rows_written += len(df)
+
+    def _flush(self):
+        if not self._pending:
+            return
+        table = pa.concat_tables(self._pending).combine_chunks()
+        self._pending, self._pending_rows = [], 0
+        if self._parquet is not None:
+            self._parquet.write_table(table, row_group_size=self.row_group_size)
+        if self._arrow is not None:
+            for batch in table.to_batches(max_chunksize=self.row_group_size):
+                self._arrow.write_batch(batch)
+
+    def close(self):
+        self._flush()
+        if self._parquet is not None:
+            self._parquet.close()
+        if self._arrow is not None:
+            self._arrow.close()
+        if 'csv' in self.formats and not self._csv_started:
+            # Keep an empty result visible to CSV consumers
+            columns = self.schema.names if self.schema is not None else []
+            pd.DataFrame(columns=columns).to_csv(self.paths['csv'], index=False)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+
+def open_writer(path_base, schema_name, formats=None, row_group_size=ROW_GROUP_SIZE):
+    return OutputWriter(path_base, schema_name, formats, row_group_size)
+
+
+def write_frame(df, path_base, schema_name, formats=None, row_group_size=ROW_GROUP_SIZE):
+    with open_writer(path_base, schema_name, formats, row_group_size) as writer:
+        for start in range(0, len(df), row_group_size):
+            writer.write(df.iloc[start:start + row_group_size])
+    return writer.paths
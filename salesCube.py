@@ -0,0 +1,379 @@
+import os
+import json
+import numpy as np
+import pandas as pd
+from sqlalchemy import create_engine
+import configparser
+import dimensionStore
+import stageProfiler
+
+# In-memory sales cube over item (with its category attributes) x customer x month.
+#
+# F_SALES is aggregated once into a sparse base cuboid of (item, customer, month) cells holding
+# quantity, revenue and cost. Each item-level key (the item itself and every attribute in
+# ITEM_ATTRIBUTES) also gets a dense [member, month, measure] rollup, so slices that do not involve
+# customers are answered with plain array indexing. Everything else falls back to masking the base
+# cells and grouping with np.unique/bincount.
+#
+# New sales lines are folded in with update_cube: member axes only ever grow (existing codes stay
+# valid) and rollups are updated in place with np.bincount.
+
+ITEM_ATTRIBUTES = ['CATEGORY_CURRENT', 'COMMODITY_CLASS', 'MASTER_PLANNING_FAMILY']
+ITEM_KEYS = ['item'] + ITEM_ATTRIBUTES
+DIMENSIONS = ITEM_KEYS + ['customer', 'month']
+MEASURES = ['QUANTITY', 'REVENUE', 'COST']
+
+DEFAULT_CACHE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cube_cache', 'sales_cube.npz')
+
+
+def read_config(config_path='config.ini'):
+    config = configparser.ConfigParser()
+    config.read(config_path)
+    return config['mysql']
+
+
+def create_db_engine(db_config):
+    return create_engine(
+        f"mysql+mysqlconnector://{db_config['user']}:{db_config['password']}@{db_config['host']}/{db_config['database']}")
+
+
+def fetch_cube_rows(connectable, after_line_sid=0):
+    # Pre-aggregate to (item, customer, month) cells in SQL; only lines past the watermark are read
+    high_watermark = int(pd.read_sql(
+        "SELECT COALESCE(MAX(SALES_DOCUMENT_LINE_SID), 0) as MAX_SID FROM F_SALES", connectable)['MAX_SID'].iloc[0])
+    attributes = ',\n        '.join(f"MAX(f.{attr}) as {attr}" for attr in ITEM_ATTRIBUTES)
+    query = f"""
+    SELECT
+        f.ITEM_SID,
+        f.BILL_CUSTOMER_SID,
+        FLOOR(f.ORDER_DATE_SID / 100) as ORDER_MONTH,
+        {attributes},
+        SUM(f.QUANTITY_SHIPPED) as QUANTITY,
+        SUM(f.EXTENDED_PRICE) as REVENUE,
+        SUM(f.EXTENDED_COST) as COST
+    FROM
+        F_SALES f
+    WHERE
+        f.SALES_DOCUMENT_LINE_SID > {int(after_line_sid)}
+        AND f.SALES_DOCUMENT_LINE_SID <= {high_watermark}
+        AND f.ORDER_DATE_SID IS NOT NULL
+    GROUP BY
+        f.ITEM_SID, f.BILL_CUSTOMER_SID, ORDER_MONTH
+    """
+    return pd.read_sql(query, connectable), high_watermark
+
+
+def _month_ordinal(yyyymm):
+    yyyymm = np.asarray(yyyymm, dtype=np.int64)
+    return (yyyymm // 100) * 12 + (yyyymm % 100 - 1)
+
+
+def month_labels(cube):
+    ordinals = cube['month_start'] + np.arange(cube['n_months'])
+    return (ordinals // 12) * 100 + ordinals % 12 + 1
+
+
+def _encode(members, values):
+    # Codes for values against a growing member list; unseen values are appended
+    index = pd.Index(members)
+    codes = index.get_indexer(values)
+    unseen = codes < 0
+    if unseen.any():
+        members = np.concatenate([members, pd.unique(np.asarray(values)[unseen])])
+        if members.dtype == object:
+            # Keep string members fixed-width so the cache stays loadable without pickle
+            members = members.astype(str)
+        codes = pd.Index(members).get_indexer(values)
+    return members, codes
+
+
+def empty_cube():
+    cube = {
+        'members': {
+            'item': np.empty(0, dtype=np.int64),
+            'customer': np.empty(0, dtype=np.int64),
+        },
+        'item_attribute_codes': {attr: np.empty(0, dtype=np.int64) for attr in ITEM_ATTRIBUTES},
+        'month_start': 0,
+        'n_months': 0,
+        'cells': {
+            'item': np.empty(0, dtype=np.int64),
+            'customer': np.empty(0, dtype=np.int64),
+            'month': np.empty(0, dtype=np.int64),
+        },
+        'measures': np.empty((0, len(MEASURES)), dtype=np.float64),
+        'rollups': {key: np.zeros((0, 0, len(MEASURES))) for key in ITEM_KEYS},
+        'watermark': 0,
+    }
+    for attr in ITEM_ATTRIBUTES:
+        cube['members'][attr] = np.empty(0, dtype=str)
+    return cube
+
+
+def _extend_months(cube, ordinals):
+    if len(ordinals) == 0:
+        return
+    lo, hi = int(ordinals.min()), int(ordinals.max())
+    if cube['n_months'] == 0:
+        cube['month_start'], cube['n_months'] = lo, 0
+    before = max(cube['month_start'] - lo, 0)
+    after = max(hi - (cube['month_start'] + cube['n_months'] - 1), 0)
+    if before or after:
+        for key, rollup in cube['rollups'].items():
+            cube['rollups'][key] = np.pad(rollup, ((0, 0), (before, after), (0, 0)))
+        cube['cells']['month'] = cube['cells']['month'] + before
+        cube['month_start'] -= before
+        cube['n_months'] += before + after
+
+
+def _accumulate(target, index, measures):
+    # target[index[i]] += measures[i] for a 2-D [n, measure] target, one bincount per measure
+    for i in range(measures.shape[1]):
+        target[:, i] += np.bincount(index, weights=measures[:, i], minlength=len(target))
+
+
+def _grow_rollup(rollup, n_members):
+    if rollup.shape[0] < n_members:
+        rollup = np.pad(rollup, ((0, n_members - rollup.shape[0]), (0, 0), (0, 0)))
+    return rollup
+
+
+def update_cube(cube, rows, watermark=None):
+    rows = rows.dropna(subset=['ORDER_MONTH'])
+    if rows.empty:
+        if watermark is not None:
+            cube['watermark'] = watermark
+        return cube
+
+    # Members: items and customers keep their codes, attributes of existing items are not reclassified
+    n_items_before = len(cube['members']['item'])
+    cube['members']['item'], item_codes = _encode(cube['members']['item'],
+                                                  rows['ITEM_SID'].fillna(-1).to_numpy(dtype=np.int64))
+    cube['members']['customer'], customer_codes = _encode(
+        cube['members']['customer'], rows['BILL_CUSTOMER_SID'].fillna(-1).to_numpy(dtype=np.int64))
+
+    new_items = item_codes >= n_items_before
+    first_rows = pd.Series(np.arange(len(rows)))[new_items].groupby(item_codes[new_items]).first()
+    for attr in ITEM_ATTRIBUTES:
+        values = rows[attr].fillna('').astype(str).to_numpy()[first_rows.to_numpy()]
+        cube['members'][attr], attr_codes = _encode(cube['members'][attr], values)
+        codes = np.full(len(cube['members']['item']), -1, dtype=np.int64)
+        codes[:n_items_before] = cube['item_attribute_codes'][attr]
+        codes[first_rows.index.to_numpy()] = attr_codes
+        cube['item_attribute_codes'][attr] = codes
+
+    ordinals = _month_ordinal(rows['ORDER_MONTH'].to_numpy(dtype=np.int64))
+    _extend_months(cube, ordinals)
+    month_codes = ordinals - cube['month_start']
+    measures = rows[MEASURES].fillna(0).to_numpy(dtype=np.float64)
+
+    # Dense rollups along each item-level key
+    for key in ITEM_KEYS:
+        key_codes = item_codes if key == 'item' else cube['item_attribute_codes'][key][item_codes]
+        rollup = _grow_rollup(cube['rollups'][key], len(cube['members'][key]))
+        _accumulate(rollup.reshape(-1, len(MEASURES)), key_codes * cube['n_months'] + month_codes, measures)
+        cube['rollups'][key] = rollup
+
+    # Sparse base cuboid: append and merge cells that now appear twice
+    cells = cube['cells']
+    item_all = np.concatenate([cells['item'], item_codes])
+    customer_all = np.concatenate([cells['customer'], customer_codes])
+    month_all = np.concatenate([cells['month'], month_codes])
+    measures_all = np.concatenate([cube['measures'], measures])
+
+    n_customers, n_months = len(cube['members']['customer']), cube['n_months']
+    linear = (item_all * n_customers + customer_all) * n_months + month_all
+    unique_keys, inverse = np.unique(linear, return_inverse=True)
+    merged = np.zeros((len(unique_keys), len(MEASURES)))
+    _accumulate(merged, inverse.ravel(), measures_all)
+
+    cells['month'] = unique_keys % n_months
+    cells['customer'] = (unique_keys // n_months) % n_customers
+    cells['item'] = unique_keys // (n_months * n_customers)
+    cube['measures'] = merged
+    if watermark is not None:
+        cube['watermark'] = watermark
+    return cube
+
+
+def build_cube(rows, watermark=None):
+    return update_cube(empty_cube(), rows, watermark)
+
+
+def _member_codes(cube, dim, values):
+    if dim == 'month':
+        if isinstance(values, tuple):
+            start, end = (_month_ordinal(v) - cube['month_start'] for v in values)
+            return np.arange(max(start, 0), min(end, cube['n_months'] - 1) + 1)
+        codes = _month_ordinal(np.atleast_1d(values)) - cube['month_start']
+        return codes[(codes >= 0) & (codes < cube['n_months'])]
+    codes = pd.Index(cube['members'][dim]).get_indexer(np.atleast_1d(values))
+    return codes[codes >= 0]
+
+
+def _labels(cube, dim, codes):
+    if dim == 'month':
+        return month_labels(cube)[codes]
+    return cube['members'][dim][codes]
+
+
+def _frame(cube, by, codes, measures):
+    df = pd.DataFrame({dim: _labels(cube, dim, c) for dim, c in zip(by, codes)})
+    for i, measure in enumerate(MEASURES):
+        df[measure] = measures[:, i]
+    return df
+
+
+def _dice_rollup(cube, key, by, filters):
+    rollup = cube['rollups'][key]
+    member_codes = _member_codes(cube, key, filters[key]) if key in filters else np.arange(rollup.shape[0])
+    month_codes = _member_codes(cube, 'month', filters['month']) if 'month' in filters else np.arange(rollup.shape[1])
+    block = rollup[np.ix_(member_codes, month_codes)]
+
+    if not by:
+        return _frame(cube, [], [], block.sum(axis=(0, 1))[None, :])
+    if by == [key]:
+        return _frame(cube, by, [member_codes], block.sum(axis=1))
+    if by == ['month']:
+        return _frame(cube, by, [month_codes], block.sum(axis=0))
+    m, t = np.meshgrid(member_codes, month_codes, indexing='ij')
+    codes = {key: m.ravel(), 'month': t.ravel()}
+    return _frame(cube, by, [codes[dim] for dim in by], block.reshape(-1, len(MEASURES)))
+
+
+def _cell_codes(cube, dim):
+    cells = cube['cells']
+    if dim in ITEM_ATTRIBUTES:
+        return cube['item_attribute_codes'][dim][cells['item']]
+    return cells[dim]
+
+
+def dice(cube, by=(), filters=None):
+    # Totals grouped by `by` over the cells matching `filters`.
+    # filters maps a dimension to a list of member values; 'month' also accepts a (start, end) YYYYMM tuple.
+    by, filters = list(by), dict(filters or {})
+    unknown = set(by) | set(filters)
+    unknown -= set(DIMENSIONS)
+    if unknown:
+        raise ValueError(f"Unknown cube dimensions: {sorted(unknown)}")
+
+    item_keys = {dim for dim in set(by) | set(filters) if dim in ITEM_KEYS}
+    if 'customer' not in by and 'customer' not in filters and len(item_keys) <= 1:
+        df = _dice_rollup(cube, item_keys.pop() if item_keys else 'item', by, filters)
+    else:
+        mask = np.ones(len(cube['measures']), dtype=bool)
+        for dim, values in filters.items():
+            mask &= np.isin(_cell_codes(cube, dim), _member_codes(cube, dim, values))
+        measures = cube['measures'][mask]
+        if not by:
+            return _frame(cube, [], [], measures.sum(axis=0)[None, :])
+        sizes = [cube['n_months'] if dim == 'month' else len(cube['members'][dim]) for dim in by]
+        linear = np.ravel_multi_index([_cell_codes(cube, dim)[mask] for dim in by], sizes)
+        groups, inverse = np.unique(linear, return_inverse=True)
+        totals = np.zeros((len(groups), len(MEASURES)))
+        _accumulate(totals, inverse.ravel(), measures)
+        df = _frame(cube, by, np.unravel_index(groups, sizes), totals)
+
+    # Dense rollups carry empty member/month combinations; drop them like a GROUP BY would
+    if by:
+        df = df[(df[MEASURES] != 0).any(axis=1)].reset_index(drop=True)
+    return df
+
+
+def slice_cube(cube, **filters):
+    return dice(cube, (), filters).iloc[0][MEASURES].to_dict()
+
+
+def top_n(cube, by, measure='REVENUE', n=20, filters=None):
+    df = dice(cube, [by], filters)
+    if len(df) > n:
+        top = np.argpartition(-df[measure].to_numpy(), n - 1)[:n]
+        df = df.iloc[top]
+    return df.sort_values(measure, ascending=False).reset_index(drop=True)
+
+
+def compare_periods(cube, by, period_a, period_b, filters=None):
+    # Measures for `by` in two month ranges side by side, with percent change from A to B
+    filters = dict(filters or {})
+    a = dice(cube, [by], {**filters, 'month': period_a}).set_index(by)
+    b = dice(cube, [by], {**filters, 'month': period_b}).set_index(by)
+    df = a.join(b, how='outer', lsuffix='_A', rsuffix='_B').fillna(0)
+    for measure in MEASURES:
+        base = df[f'{measure}_A']
+        df[f'{measure}_CHANGE_PERCENT'] = (df[f'{measure}_B'] - base) / base.where(base > 0) * 100
+    return df.reset_index()
+
+
+def save_cube(cube, path=DEFAULT_CACHE_PATH):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    meta = {'month_start': int(cube['month_start']), 'n_months': int(cube['n_months']),
+            'watermark': int(cube['watermark'])}
+    arrays = {f'members_{dim}': values for dim, values in cube['members'].items()}
+    arrays.update({f'attr_codes_{attr}': codes for attr, codes in cube['item_attribute_codes'].items()})
+    arrays.update({f'cells_{dim}': codes for dim, codes in cube['cells'].items()})
+    arrays.update({f'rollup_{key}': rollup for key, rollup in cube['rollups'].items()})
+    tmp_path = path + '.tmp.npz'
+    np.savez(tmp_path, meta=np.array(json.dumps(meta)), measures=cube['measures'], **arrays)
+    os.replace(tmp_path, path)
+
+
+def load_cube(path=DEFAULT_CACHE_PATH):
+    if not os.path.exists(path):
+        return None
+    with np.load(path) as data:
+        meta = json.loads(str(data['meta']))
+        cube = empty_cube()
+        cube.update(meta)
+        for dim in cube['members']:
+            cube['members'][dim] = data[f'members_{dim}']
+        for attr in ITEM_ATTRIBUTES:
+            cube['item_attribute_codes'][attr] = data[f'attr_codes_{attr}']
+        for dim in cube['cells']:
+            cube['cells'][dim] = data[f'cells_{dim}']
+        for key in ITEM_KEYS:
+            cube['rollups'][key] = data[f'rollup_{key}']
+        cube['measures'] = data['measures']
+    return cube
+
+
+def refresh_cube(connectable, path=DEFAULT_CACHE_PATH):
+    # Load the cached cube and fold in only the lines that arrived since it was saved
+    cube = load_cube(path) or empty_cube()
+    rows, high_watermark = fetch_cube_rows(connectable, cube['watermark'])
+    update_cube(cube, rows, high_watermark)
+    save_cube(cube, path)
+    print(f"Sales cube: {len(rows)} new cells, {len(cube['measures'])} total cells, {cube['n_months']} months")
+    return cube
+
+
+def main():
+    db_config = read_config()
+    engine = create_db_engine(db_config)
+    with stageProfiler.span('fetch', 'F_SALES cube cells'):
+        cube = refresh_cube(engine)
+    if cube['n_months'] == 0:
+        print("No sales data found.")
+        return
+
+    with stageProfiler.span('fetch', 'D_ITEMS dimension'):
+        items = dimensionStore.load_dimension(engine, 'items')
+    with stageProfiler.span('aggregate', 'top items'):
+        top_items = top_n(cube, 'item', n=20)
+    top_items.insert(1, 'ITEM_NUMBER', dimensionStore.lookup(items, 'ITEM_NUMBER', top_items['item']))
+    print("\nTop Items by Revenue:")
+    print(top_items.to_string(index=False))
+
+    print("\nTop Categories by Revenue:")
+    print(top_n(cube, 'CATEGORY_CURRENT', n=10).to_string(index=False))
+
+    # Last 6 months against the 6 before them, per commodity class
+    months = month_labels(cube)
+    if len(months) >= 12:
+        previous, recent = (months[-12], months[-7]), (months[-6], months[-1])
+        comparison = compare_periods(cube, 'COMMODITY_CLASS', previous, recent)
+        print(f"\nCommodity Classes {previous[0]}-{previous[1]} vs {recent[0]}-{recent[1]}:")
+        print(comparison.sort_values('REVENUE_CHANGE_PERCENT').head(20).to_string(index=False))
+
+
+if __name__ == "__main__":
+    main()
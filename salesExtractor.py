@@ -0,0 +1,196 @@
+import os
+import json
+import time
+import shutil
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import pandas as pd
+from sqlalchemy import create_engine, text
+import outputWriter
+
+# Parallel, resumable extraction of F_SALES.
+#
+# The SALES_DOCUMENT_LINE_SID span (fixed when the extraction is planned) is cut into ranges that
+# pooled connections fetch in parallel, each with keyset pagination (SID > last seen ORDER BY SID
+# LIMIT page). Every finished range is written as a part file and recorded in manifest.json, so an
+# interrupted extraction resumes with only the missing ranges. The checkpoint exists only for resuming:
+# extract_frame removes it once the parts are read back, and a completed extraction left behind by
+# extract is replaced by a fresh plan on the next call.
+#
+# Worker count (EXPLORE_EXTRACT_WORKERS, default 4) is capped by EXPLORE_EXTRACT_MAX_CONNECTIONS, and
+# when EXPLORE_EXTRACT_MAX_THREADS_RUNNING is set workers pause while the server reports more running threads.
+
+KEY = 'SALES_DOCUMENT_LINE_SID'
+CHECKPOINT_ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'extract_checkpoints')
+
+DEFAULT_WORKERS = int(os.environ.get('EXPLORE_EXTRACT_WORKERS', 4))
+MAX_CONNECTIONS = int(os.environ.get('EXPLORE_EXTRACT_MAX_CONNECTIONS', 8))
+MAX_THREADS_RUNNING = int(os.environ.get('EXPLORE_EXTRACT_MAX_THREADS_RUNNING', 0)) or None
+RANGE_SIZE = 500000
+PAGE_SIZE = 50000
+LOAD_BACKOFF_SECONDS = 2.0
+
+PART_EXTENSION = '.parquet' if outputWriter.pa is not None else '.pkl'
+
+
+def create_pooled_engine(db_config, workers):
+    return create_engine(
+        f"mysql+mysqlconnector://{db_config['user']}:{db_config['password']}@{db_config['host']}/{db_config['database']}",
+        pool_size=workers, max_overflow=0, pool_pre_ping=True)
+
+
+def plan_ranges(min_sid, max_sid, range_size=RANGE_SIZE):
+    # Half-open (after, end] SID ranges covering [min_sid, max_sid]
+    ranges = []
+    after = min_sid - 1
+    while after < max_sid:
+        end = min(after + range_size, max_sid)
+        ranges.append((after, end))
+        after = end
+    return ranges
+
+
+def _manifest_path(checkpoint_dir):
+    return os.path.join(checkpoint_dir, 'manifest.json')
+
+
+def _part_path(checkpoint_dir, after, end):
+    return os.path.join(checkpoint_dir, f'part-{after + 1}-{end}{PART_EXTENSION}')
+
+
+def _save_manifest(checkpoint_dir, manifest):
+    tmp_path = _manifest_path(checkpoint_dir) + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_path, _manifest_path(checkpoint_dir))
+
+
+def _load_manifest(checkpoint_dir):
+    path = _manifest_path(checkpoint_dir)
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+def _write_part(df, path):
+    tmp_path = path + '.tmp'
+    if PART_EXTENSION == '.parquet':
+        df.to_parquet(tmp_path, index=False, compression=outputWriter.PARQUET_COMPRESSION)
+    else:
+        df.to_pickle(tmp_path)
+    os.replace(tmp_path, path)
+
+
+def _read_part(path):
+    if path.endswith('.parquet'):
+        return pd.read_parquet(path)
+    return pd.read_pickle(path)
+
+
+def _wait_for_server(connection):
+    # Back off while the server is busier than the configured limit
+    while MAX_THREADS_RUNNING is not None:
+        row = connection.execute(text("SHOW GLOBAL STATUS LIKE 'Threads_running'")).fetchone()
+        if row is None or int(row[1]) <= MAX_THREADS_RUNNING:
+            return
+        time.sleep(LOAD_BACKOFF_SECONDS)
+
+
+def fetch_range(engine, columns, after, end, where=None, page_size=PAGE_SIZE):
+    select_columns = ', '.join(columns)
+    condition = f" AND ({where})" if where else ""
+    query = text(f"""
+        SELECT {select_columns}
+        FROM F_SALES
+        WHERE {KEY} > :after AND {KEY} <= :end{condition}
+        ORDER BY {KEY}
+        LIMIT :page_size
+    """)
+
+    pages = []
+    with engine.connect() as connection:
+        while True:
+            _wait_for_server(connection)
+            page = pd.read_sql(query, connection, params={'after': after, 'end': end, 'page_size': page_size})
+            if not page.empty:
+                pages.append(page)
+            if len(page) < page_size:
+                break
+            after = int(page[KEY].iloc[-1])
+    if not pages:
+        return pd.DataFrame(columns=columns)
+    return pd.concat(pages, ignore_index=True)
+
+
+def extract(db_config, columns, name, workers=None, where=None, range_size=RANGE_SIZE,
+            page_size=PAGE_SIZE, checkpoint_root=CHECKPOINT_ROOT):
+    columns = list(columns) if KEY in columns else [KEY] + list(columns)
+    workers = max(1, min(workers or DEFAULT_WORKERS, MAX_CONNECTIONS))
+    checkpoint_dir = os.path.join(checkpoint_root, name)
+    engine = create_pooled_engine(db_config, workers)
+
+    manifest = _load_manifest(checkpoint_dir)
+    if manifest and not manifest['complete'] and manifest['columns'] == columns and manifest['where'] == where:
+        print(f"Resuming extraction '{name}': {len(manifest['done'])} of {len(manifest['ranges'])} ranges done")
+    else:
+        # Fix the SID span now so a resumed extraction reads the same snapshot of F_SALES
+        bounds = pd.read_sql(f"SELECT MIN({KEY}) as MIN_SID, MAX({KEY}) as MAX_SID FROM F_SALES", engine).iloc[0]
+        ranges = [] if pd.isna(bounds['MIN_SID']) else plan_ranges(int(bounds['MIN_SID']), int(bounds['MAX_SID']),
+                                                                  range_size)
+        shutil.rmtree(checkpoint_dir, ignore_errors=True)
+        os.makedirs(checkpoint_dir)
+        manifest = {'columns': columns, 'where': where, 'ranges': ranges, 'done': [], 'complete': False}
+        _save_manifest(checkpoint_dir, manifest)
+
+    done = {tuple(r) for r in manifest['done']}
+    pending = [tuple(r) for r in manifest['ranges'] if tuple(r) not in done]
+    lock = threading.Lock()
+    started = time.perf_counter()
+    progress = {'rows': 0}
+
+    def run(after, end):
+        df = fetch_range(engine, columns, after, end, where, page_size)
+        _write_part(df, _part_path(checkpoint_dir, after, end))
+        # Record the range as soon as its part exists, whatever happens to the other ranges
+        with lock:
+            progress['rows'] += len(df)
+            manifest['done'].append([after, end])
+            _save_manifest(checkpoint_dir, manifest)
+            rows = progress['rows']
+            print(f"Extracted range {len(manifest['done'])}/{len(manifest['ranges'])} "
+                  f"({rows} rows, {rows / max(time.perf_counter() - started, 1e-9):,.0f} rows/s)")
+
+    pool = ThreadPoolExecutor(max_workers=workers)
+    futures = []
+    try:
+        futures = [pool.submit(run, after, end) for after, end in pending]
+        for future in as_completed(futures):
+            if future.exception() is not None:
+                # Cancelled futures never complete as_completed, so stop waiting here; ranges already
+                # running still finish and record themselves before shutdown returns
+                break
+    finally:
+        pool.shutdown(wait=True, cancel_futures=True)
+        engine.dispose()
+
+    errors = [f.exception() for f in futures if not f.cancelled() and f.exception() is not None]
+    if errors:
+        raise errors[0]
+
+    manifest['complete'] = True
+    _save_manifest(checkpoint_dir, manifest)
+    return [_part_path(checkpoint_dir, after, end) for after, end in manifest['ranges']]
+
+
+def extract_frame(db_config, columns, name, checkpoint_root=CHECKPOINT_ROOT, **kwargs):
+    # Extract (or resume) and return the result as one frame in SID order, without the key unless requested
+    parts = extract(db_config, columns, name, checkpoint_root=checkpoint_root, **kwargs)
+    frames = [_read_part(path) for path in parts]
+    frames = [df for df in frames if not df.empty]
+    df = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=[KEY] + list(columns))
+    # The parts are in memory now; keeping them would only leave a stale copy of F_SALES on disk
+    shutil.rmtree(os.path.join(checkpoint_root, name), ignore_errors=True)
+    if KEY not in columns:
+        df = df.drop(columns=[KEY])
+    return df
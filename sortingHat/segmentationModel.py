@@ -0,0 +1,171 @@
+import os
+import json
+import glob
+import bisect
+import logging
+from datetime import datetime
+import numpy as np
+import pandas as pd
+
+# Fitted KMeans revenue segmentation saved as a small versioned JSON artifact.
+# Revenue is one-dimensional, so nearest-centre assignment reduces to a binary search over the
+# midpoints between sorted centres: O(log k) per customer, no scaler or KMeans needed at assign time.
+#
+# The per-customer totals and clusters are kept in assignments.npz together with the
+# SALES_DOCUMENT_LINE_SID watermark they include, so a run only folds in the lines added since.
+# Lines corrected or deleted below the watermark are not seen that way; run sortingHat with
+# --full-reload to recompute the totals from all of F_SALES.
+
+MODEL_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'models')
+ASSIGNMENTS_PATH = os.path.join(MODEL_DIR, 'assignments.npz')
+MODEL_FORMAT = 1
+
+# Population stability index over segment shares above which the model is refitted
+DRIFT_THRESHOLD = 0.2
+
+
+def build_model(scaler, kmeans, total_revenue, version):
+    scale = float(scaler.scale_[0])
+    mean = float(scaler.mean_[0])
+    centers_scaled = np.sort(kmeans.cluster_centers_.ravel())
+    boundaries_scaled = (centers_scaled[:-1] + centers_scaled[1:]) / 2
+    n_clusters = len(centers_scaled)
+
+    model = {
+        'format': MODEL_FORMAT,
+        'version': version,
+        'fitted_at': datetime.now().isoformat(timespec='seconds'),
+        'scaler': {'mean': mean, 'scale': scale},
+        'centers': (centers_scaled * scale + mean).tolist(),
+        'boundaries': (boundaries_scaled * scale + mean).tolist(),
+        # Centres are sorted ascending, and Segment 1 is the highest-revenue segment
+        'labels': [f'Segment {n_clusters - i}' for i in range(n_clusters)],
+        'n_customers': int(len(total_revenue)),
+    }
+    model['segment_shares'] = segment_shares(model, total_revenue).tolist()
+    return model
+
+
+def assign_clusters(model, total_revenue):
+    # Batch assignment; side='left' sends a revenue sitting exactly on a boundary to the lower segment
+    return np.searchsorted(np.asarray(model['boundaries']), np.asarray(total_revenue, dtype=np.float64),
+                           side='left')
+
+
+def assign_segments(model, total_revenue):
+    return np.asarray(model['labels'])[assign_clusters(model, total_revenue)]
+
+
+def assign_customer(model, total_revenue):
+    # Streaming assignment for a single customer
+    return model['labels'][bisect.bisect_left(model['boundaries'], total_revenue)]
+
+
+def segment_shares(model, total_revenue):
+    counts = np.bincount(assign_clusters(model, total_revenue), minlength=len(model['labels']))
+    return counts / max(counts.sum(), 1)
+
+
+def drift_score(model, total_revenue):
+    # Population stability index between the fit-time and current segment shares
+    expected = np.clip(np.asarray(model['segment_shares']), 1e-6, None)
+    actual = np.clip(segment_shares(model, total_revenue), 1e-6, None)
+    return float(np.sum((actual - expected) * np.log(actual / expected)))
+
+
+def needs_refit(model, total_revenue, threshold=DRIFT_THRESHOLD):
+    if model is None:
+        return True
+    score = drift_score(model, total_revenue)
+    logging.info(f"Segmentation drift (PSI) against model v{model['version']}: {score:.4f}")
+    return score > threshold
+
+
+def add_sales(customer_summary, new_sales):
+    # Add new sales lines to the running per-customer totals; returns the summary and the customers touched
+    deltas = new_sales.groupby('BILL_CUSTOMER_SID')['EXTENDED_PRICE'].sum()
+    deltas.index = deltas.index.astype(np.int64)
+    deltas.index.name = 'CUSTOMER_ID'
+    summary = customer_summary.set_index('CUSTOMER_ID')
+    touched = deltas.index
+
+    summary = summary.reindex(summary.index.union(deltas.index))
+    summary.loc[touched, 'TOTAL_REVENUE'] = summary.loc[touched, 'TOTAL_REVENUE'].fillna(0) + deltas.loc[touched]
+    return summary.reset_index(), touched
+
+
+def update_assignments(model, customer_summary, new_sales):
+    # Fold in new sales lines and reassign only the customers they touch
+    summary, touched = add_sales(customer_summary, new_sales)
+    summary = summary.set_index('CUSTOMER_ID')
+    clusters = assign_clusters(model, summary.loc[touched, 'TOTAL_REVENUE'])
+    summary.loc[touched, 'CLUSTER'] = clusters
+    summary.loc[touched, 'SEGMENT'] = np.asarray(model['labels'])[clusters]
+    summary['CLUSTER'] = summary['CLUSTER'].astype(int)
+    return summary.reset_index()
+
+
+def save_assignments(customer_summary, watermark, model_version, path=ASSIGNMENTS_PATH):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + '.tmp.npz'
+    np.savez(tmp_path, meta=np.array(json.dumps({'watermark': int(watermark), 'model_version': model_version})),
+             customer_id=customer_summary['CUSTOMER_ID'].to_numpy(dtype=np.int64),
+             total_revenue=customer_summary['TOTAL_REVENUE'].to_numpy(dtype=np.float64),
+             cluster=customer_summary['CLUSTER'].to_numpy(dtype=np.int64))
+    os.replace(tmp_path, path)
+
+
+def load_assignments(model, path=ASSIGNMENTS_PATH):
+    # Saved totals and watermark; segments are only restored when they were assigned by this model
+    if not os.path.exists(path):
+        return None, None
+    with np.load(path) as data:
+        meta = json.loads(str(data['meta']))
+        summary = pd.DataFrame({'CUSTOMER_ID': data['customer_id'], 'TOTAL_REVENUE': data['total_revenue']})
+        if model is not None and meta['model_version'] == model['version']:
+            summary['CLUSTER'] = data['cluster']
+            summary['SEGMENT'] = np.asarray(model['labels'])[data['cluster']]
+    return summary, meta['watermark']
+
+
+def _model_path(model_dir, version):
+    return os.path.join(model_dir, f'segmentation_v{version}.json')
+
+
+def save_model(model, model_dir=MODEL_DIR):
+    os.makedirs(model_dir, exist_ok=True)
+    path = _model_path(model_dir, model['version'])
+    with open(path, 'w') as f:
+        json.dump(model, f, indent=2)
+    return path
+
+
+def load_latest_model(model_dir=MODEL_DIR):
+    versions = []
+    for path in glob.glob(os.path.join(model_dir, 'segmentation_v*.json')):
+        name = os.path.basename(path)[len('segmentation_v'):-len('.json')]
+        if name.isdigit():
+            versions.append(int(name))
+    if not versions:
+        return None
+
+    with open(_model_path(model_dir, max(versions))) as f:
+        model = json.load(f)
+    if model.get('format') != MODEL_FORMAT:
+        logging.warning(f"Ignoring segmentation model with unsupported format {model.get('format')}")
+        return None
+    return model
+
+
+def summarize_customers(df):
+    customer_summary = df.groupby('BILL_CUSTOMER_SID')['EXTENDED_PRICE'].sum().reset_index()
+    customer_summary.columns = ['CUSTOMER_ID', 'TOTAL_REVENUE']
+    return customer_summary
+
+
+def apply_model(model, customer_summary):
+    customer_summary = customer_summary.copy()
+    clusters = assign_clusters(model, customer_summary['TOTAL_REVENUE'])
+    customer_summary['CLUSTER'] = clusters
+    customer_summary['SEGMENT'] = pd.Series(np.asarray(model['labels'])[clusters], index=customer_summary.index)
+    return customer_summary
@@ -1,11 +1,21 @@
+import os
+import sys
+import argparse
 import configparser
 import pandas as pd
 import numpy as np
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, text
 import logging
 from sklearn.cluster import KMeans
 from sklearn.preprocessing import StandardScaler
 import matplotlib.pyplot as plt
+import segmentationModel
+
+# Make the shared top-level modules importable
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import stageProfiler
+import outputWriter
+import salesExtractor
 
 # Set up logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -22,15 +32,25 @@ def create_db_engine(config):
         f"mysql+mysqlconnector://{config['mysql']['user']}:{config['mysql']['password']}@{config['mysql']['host']}/{config['mysql']['database']}")
 
 
-def fetch_sales_data(engine):
+def fetch_sales_data(config):
+    # Parallel, checkpointed pull of F_SALES; an interrupted run resumes where it stopped
+    return salesExtractor.extract_frame(config['mysql'],
+                                        ['SALES_DOCUMENT_LINE_SID', 'BILL_CUSTOMER_SID', 'EXTENDED_PRICE'],
+                                        'sorting_hat')
+
+
+def fetch_new_sales(engine, watermark):
     query = """
     SELECT 
+        SALES_DOCUMENT_LINE_SID, 
         BILL_CUSTOMER_SID, 
         EXTENDED_PRICE
     FROM 
         F_SALES
+    WHERE 
+        SALES_DOCUMENT_LINE_SID > :watermark
     """
-    return pd.read_sql(query, engine)
+    return pd.read_sql(text(query), engine, params={'watermark': watermark})
 
 
 def elbow_method(data):
@@ -59,22 +79,16 @@ def elbow_method(data):
     return elbow_point
 
 
-def kmeans_segmentation(df, n_clusters):
-    customer_summary = df.groupby('BILL_CUSTOMER_SID')['EXTENDED_PRICE'].sum().reset_index()
-    customer_summary.columns = ['CUSTOMER_ID', 'TOTAL_REVENUE']
-
+def kmeans_segmentation(customer_summary, n_clusters, version=1):
     scaler = StandardScaler()
     revenue_scaled = scaler.fit_transform(customer_summary['TOTAL_REVENUE'].values.reshape(-1, 1))
 
     kmeans = KMeans(n_clusters=n_clusters, random_state=42)
-    customer_summary['CLUSTER'] = kmeans.fit_predict(revenue_scaled)
-
-    # Sort clusters by mean revenue
-    cluster_order = customer_summary.groupby('CLUSTER')['TOTAL_REVENUE'].mean().sort_values(ascending=False).index
-    cluster_mapping = {cluster: f'Segment {i + 1}' for i, cluster in enumerate(cluster_order)}
-    customer_summary['SEGMENT'] = customer_summary['CLUSTER'].map(cluster_mapping)
+    kmeans.fit(revenue_scaled)
 
-    return customer_summary
+    # Persist the fit as boundaries + labels; clusters are numbered by ascending revenue
+    model = segmentationModel.build_model(scaler, kmeans, customer_summary['TOTAL_REVENUE'].values, version)
+    return segmentationModel.apply_model(model, customer_summary), model
 
 
 def print_summary(customer_summary):
@@ -105,26 +119,66 @@ def plot_revenue_distribution(customer_summary):
     plt.close()
 
 
-def main():
+def main(force_refit=False, full_reload=False):
     try:
         config = load_config()
-        engine = create_db_engine(config)
-        df = fetch_sales_data(engine)
-
-        # K-means Segmentation
-        optimal_k = elbow_method(df.groupby('BILL_CUSTOMER_SID')['EXTENDED_PRICE'].sum().values)
-        logging.info(f"\nOptimal number of clusters based on Elbow Method: {optimal_k}")
+        model = segmentationModel.load_latest_model()
+        customer_summary, watermark = segmentationModel.load_assignments(model)
+
+        if customer_summary is None or full_reload:
+            with stageProfiler.span('fetch', 'F_SALES revenue'):
+                df = fetch_sales_data(config)
+            with stageProfiler.span('aggregate', 'customer revenue'):
+                watermark = int(df['SALES_DOCUMENT_LINE_SID'].max()) if len(df) else 0
+                customer_summary = segmentationModel.summarize_customers(df)
+                del df
+        else:
+            # Only the lines added since the saved totals; customers they touch are reassigned
+            with stageProfiler.span('fetch', 'new F_SALES lines'):
+                new_sales = fetch_new_sales(create_db_engine(config), watermark)
+            logging.info(f"Folding {len(new_sales)} new sales lines into saved customer totals")
+            with stageProfiler.span('aggregate', 'customer revenue'):
+                if len(new_sales):
+                    watermark = int(new_sales['SALES_DOCUMENT_LINE_SID'].max())
+                if 'SEGMENT' in customer_summary:
+                    customer_summary = segmentationModel.update_assignments(model, customer_summary, new_sales)
+                else:
+                    customer_summary, _ = segmentationModel.add_sales(customer_summary, new_sales)
+
+        # Reuse the saved segmentation unless the revenue distribution has drifted away from it
+        if force_refit or segmentationModel.needs_refit(model, customer_summary['TOTAL_REVENUE'].values):
+            # K-means Segmentation
+            with stageProfiler.span('model', 'elbow method'):
+                optimal_k = elbow_method(customer_summary['TOTAL_REVENUE'].values)
+            logging.info(f"\nOptimal number of clusters based on Elbow Method: {optimal_k}")
+
+            version = model['version'] + 1 if model else 1
+            with stageProfiler.span('model', 'kmeans fit'):
+                kmeans_summary, model = kmeans_segmentation(customer_summary[['CUSTOMER_ID', 'TOTAL_REVENUE']],
+                                                            optimal_k, version)
+            model_path = segmentationModel.save_model(model)
+            logging.info(f"Saved segmentation model v{version} to {model_path}")
+        elif 'SEGMENT' not in customer_summary:
+            logging.info(f"Assigning segments with saved model v{model['version']}")
+            with stageProfiler.span('model', 'assign segments'):
+                kmeans_summary = segmentationModel.apply_model(model, customer_summary)
+        else:
+            kmeans_summary = customer_summary
+
+        with stageProfiler.span('write', 'customer assignments'):
+            segmentationModel.save_assignments(kmeans_summary, watermark, model['version'])
 
-        kmeans_summary = kmeans_segmentation(df, optimal_k)
         logging.info("\nK-means Segmentation:")
         print_summary(kmeans_summary)
 
         # Plot revenue distribution
-        plot_revenue_distribution(kmeans_summary)
+        with stageProfiler.span('plot', 'revenue by segment'):
+            plot_revenue_distribution(kmeans_summary)
 
         # Save results
-        kmeans_summary.to_csv('kmeans_segmentation.csv', index=False)
-        logging.info("\nAnalysis complete. Results saved to CSV file.")
+        with stageProfiler.span('write', 'kmeans_segmentation'):
+            output_paths = outputWriter.write_frame(kmeans_summary, 'kmeans_segmentation', 'kmeans_segmentation')
+        logging.info(f"\nAnalysis complete. Results saved to {', '.join(output_paths.values())}.")
         logging.info("Elbow curve plot saved as 'elbow_curve.png'.")
         logging.info("Revenue distribution plot saved as 'revenue_distribution_by_segment.png'.")
 
@@ -133,4 +187,10 @@ def main():
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description='Segment customers by total revenue.')
+    parser.add_argument('--refit', action='store_true',
+                        help='fit a new segmentation model even if the saved one has not drifted')
+    parser.add_argument('--full-reload', action='store_true',
+                        help='recompute customer totals from all of F_SALES, picking up corrected or deleted lines')
+    args = parser.parse_args()
+    main(force_refit=args.refit, full_reload=args.full_reload)
\ No newline at end of file
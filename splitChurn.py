@@ -4,6 +4,7 @@ import pandas as pd
 import mysql.connector
 from sqlalchemy import create_engine
 import configparser
+import stageProfiler
 
 # ... (keep the config reading part from the previous script) ...
 
@@ -12,7 +13,7 @@ try:
         f"mysql+mysqlconnector://{db_config['user']}:{db_config['password']}@{db_config['host']}/{db_config['database']}")
 
     # Inspect table structure
-    with engine.connect() as connection:
+    with engine.connect() as connection, stageProfiler.span('fetch', 'F_SALES_QUOTES inspection'):
         result = connection.execute("DESCRIBE F_SALES_QUOTES")
         print("F_SALES_QUOTES table structure:")
         for row in result:
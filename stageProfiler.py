@@ -0,0 +1,222 @@
+import os
+import sys
+import json
+import time
+import atexit
+import threading
+import tracemalloc
+from collections import Counter
+from contextlib import contextmanager
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# Lightweight stage spans for the analysis scripts.
+#
+#   with stageProfiler.span('fetch', 'F_SALES lines'):
+#       df = pd.read_sql(query, engine)
+#
+# Wall and CPU time are always recorded. Setting environment variables turns on the rest:
+#   EXPLORE_TRACE=trace.json        write a Chrome trace (chrome://tracing, Perfetto) at exit
+#   EXPLORE_TRACEMALLOC=1           record Python allocation deltas and peaks per span
+#   EXPLORE_SAMPLE=profile.json     run the sampling profiler and write a speedscope profile at exit
+#   EXPLORE_SAMPLE_INTERVAL=0.005   sampling interval in seconds
+
+STAGES = ('fetch', 'transform', 'aggregate', 'model', 'plot', 'write')
+
+TRACE_PATH = os.environ.get('EXPLORE_TRACE')
+TRACEMALLOC_ENABLED = os.environ.get('EXPLORE_TRACEMALLOC', '') not in ('', '0')
+SAMPLE_PATH = os.environ.get('EXPLORE_SAMPLE')
+SAMPLE_INTERVAL = float(os.environ.get('EXPLORE_SAMPLE_INTERVAL', '0.005'))
+
+_events = []
+_stack = []
+_origin = time.perf_counter()
+
+
+def peak_rss_bytes():
+    if resource is not None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # ru_maxrss is in kilobytes on Linux and bytes on macOS
+        return peak if sys.platform == 'darwin' else peak * 1024
+    if psutil is not None:
+        # Windows has no resource module; psutil reports the peak working set there
+        return getattr(psutil.Process().memory_info(), 'peak_wset', None)
+    return None
+
+
+def _micros(seconds):
+    return round(seconds * 1e6, 3)
+
+
+@contextmanager
+def span(stage, name=None):
+    if stage not in STAGES:
+        raise ValueError(f"Unknown stage '{stage}', expected one of {STAGES}")
+
+    record = {'stage': stage, 'name': name or stage, 'child_peak': 0}
+    if TRACEMALLOC_ENABLED:
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+        current, peak = tracemalloc.get_traced_memory()
+        # Nested spans reset the tracemalloc peak, so hand the peak so far to the enclosing span first
+        if _stack:
+            _stack[-1]['child_peak'] = max(_stack[-1]['child_peak'], peak)
+        tracemalloc.reset_peak()
+        record['alloc_start'] = current
+
+    _stack.append(record)
+    rss_start = peak_rss_bytes()
+    cpu_start = time.process_time()
+    wall_start = time.perf_counter()
+    try:
+        yield record
+    finally:
+        wall_end = time.perf_counter()
+        cpu_end = time.process_time()
+        _stack.pop()
+
+        args = {
+            'wall_s': wall_end - wall_start,
+            'cpu_s': cpu_end - cpu_start,
+            'peak_rss_bytes': peak_rss_bytes(),
+        }
+        if rss_start is not None:
+            args['peak_rss_growth_bytes'] = args['peak_rss_bytes'] - rss_start
+        if TRACEMALLOC_ENABLED:
+            current, peak = tracemalloc.get_traced_memory()
+            peak = max(peak, record['child_peak'])
+            args['alloc_delta_bytes'] = current - record['alloc_start']
+            args['alloc_peak_bytes'] = peak - record['alloc_start']
+            if _stack:
+                _stack[-1]['child_peak'] = max(_stack[-1]['child_peak'], peak)
+
+        _events.append({
+            'name': record['name'],
+            'cat': stage,
+            'ph': 'X',
+            'ts': _micros(wall_start - _origin),
+            'dur': _micros(wall_end - wall_start),
+            'pid': os.getpid(),
+            'tid': threading.get_ident(),
+            'args': args,
+        })
+
+
+def summary():
+    # Wall/CPU seconds per stage summed over its spans
+    totals = {}
+    for event in _events:
+        entry = totals.setdefault(event['cat'], {'wall_s': 0.0, 'cpu_s': 0.0, 'spans': 0})
+        entry['spans'] += 1
+        entry['wall_s'] += event['args']['wall_s']
+        entry['cpu_s'] += event['args']['cpu_s']
+    return totals
+
+
+def print_summary():
+    if not _events:
+        return
+    print("\nStage profile:")
+    print("{:<12} {:<8} {:<12} {:<12}".format("Stage", "Spans", "Wall (s)", "CPU (s)"))
+    for stage, entry in summary().items():
+        print("{:<12} {:<8} {:<12.3f} {:<12.3f}".format(stage, entry['spans'], entry['wall_s'], entry['cpu_s']))
+
+
+def write_chrome_trace(path):
+    with open(path, 'w') as f:
+        json.dump({'traceEvents': _events, 'displayTimeUnit': 'ms'}, f)
+    print(f"Stage trace written to {path}")
+
+
+class _Sampler(threading.Thread):
+    # Periodically captures the main thread's stack; aggregated into a speedscope sampled profile
+
+    def __init__(self, path, interval):
+        super().__init__(name='stageProfiler-sampler', daemon=True)
+        self.path = path
+        self.interval = interval
+        # Seconds attributed to each stack
+        self.samples = Counter()
+        self.target = threading.main_thread().ident
+        self.stopped = threading.Event()
+
+    def run(self):
+        last = time.perf_counter()
+        while not self.stopped.wait(self.interval):
+            # Weight by the time actually elapsed: waiting for the GIL stretches the interval
+            now = time.perf_counter()
+            elapsed, last = now - last, now
+            frame = sys._current_frames().get(self.target)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append((code.co_name, code.co_filename, code.co_firstlineno))
+                frame = frame.f_back
+            if stack:
+                self.samples[tuple(reversed(stack))] += elapsed
+
+    def write_speedscope(self, path=None):
+        path = path or self.path
+        frames, frame_ids, samples, weights = [], {}, [], []
+        for stack, seconds in self.samples.items():
+            ids = []
+            for name, filename, line in stack:
+                key = (name, filename, line)
+                if key not in frame_ids:
+                    frame_ids[key] = len(frames)
+                    frames.append({'name': name, 'file': filename, 'line': line})
+                ids.append(frame_ids[key])
+            samples.append(ids)
+            weights.append(seconds)
+
+        profile = {
+            '$schema': 'https://www.speedscope.app/file-format-schema.json',
+            'shared': {'frames': frames},
+            'profiles': [{
+                'type': 'sampled',
+                'name': os.path.basename(sys.argv[0]) or 'python',
+                'unit': 'seconds',
+                'startValue': 0,
+                'endValue': sum(weights),
+                'samples': samples,
+                'weights': weights,
+            }],
+            'exporter': 'stageProfiler',
+        }
+        with open(path, 'w') as f:
+            json.dump(profile, f)
+        print(f"Sampling profile written to {path}")
+
+
+_sampler = None
+
+
+def start_sampling(path='profile.speedscope.json', interval=SAMPLE_INTERVAL):
+    global _sampler
+    if _sampler is None:
+        _sampler = _Sampler(path, interval)
+        _sampler.start()
+    return _sampler
+
+
+def _finish():
+    if _sampler is not None:
+        _sampler.stopped.set()
+        _sampler.join()
+        _sampler.write_speedscope()
+    if TRACE_PATH:
+        print_summary()
+        write_chrome_trace(TRACE_PATH)
+
+
+if SAMPLE_PATH:
+    start_sampling(SAMPLE_PATH)
+atexit.register(_finish)
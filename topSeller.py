@@ -1,7 +1,9 @@
-import mysql.connector
-from mysql.connector import Error
 import configparser
 from decimal import Decimal
+import pandas as pd
+from sqlalchemy import create_engine
+import dimensionStore
+import stageProfiler
 
 
 def read_config(config_path='config.ini'):
@@ -10,86 +12,93 @@ def read_config(config_path='config.ini'):
     return config['mysql']
 
 
-def connect_to_database(db_config):
-    try:
-        connection = mysql.connector.connect(
-            host=db_config['host'],
-            port=int(db_config['port']),
-            user=db_config['user'],
-            password=db_config['password'],
-            database=db_config['database']
-        )
-        if connection.is_connected():
-            print(f"Connected to MySQL Server on {db_config['host']}")
-        return connection
-    except Error as e:
-        print(f"Error connecting to MySQL: {e}")
-        return None
+def create_db_engine(db_config):
+    return create_engine(
+        f"mysql+mysqlconnector://{db_config['user']}:{db_config['password']}@{db_config['host']}:{int(db_config['port'])}/{db_config['database']}")
 
 
-def get_top_products_by_revenue(connection, limit=20):
+def get_top_products_by_revenue(engine, limit=20):
+    # Aggregate per ITEM_SID in SQL and resolve item attributes from the cached dimension store
     query = """
     SELECT 
-        d.ITEM_NUMBER,
-        d.ITEM_DESCRIPTION,
+        f.ITEM_SID,
         SUM(f.QUANTITY_SHIPPED) as TOTAL_QUANTITY,
         SUM(f.EXTENDED_PRICE) as TOTAL_REVENUE,
-        AVG(f.UNIT_PRICE) as AVG_UNIT_PRICE,
+        SUM(f.UNIT_PRICE) as UNIT_PRICE_SUM,
+        COUNT(f.UNIT_PRICE) as UNIT_PRICE_COUNT,
         SUM(f.EXTENDED_COST) as TOTAL_COST,
-        SUM(f.EXTENDED_PRICE) - SUM(f.EXTENDED_COST) as GROSS_PROFIT,
         MIN(f.ORDER_DATE_SID) as FIRST_ORDER_DATE,
         MAX(f.ORDER_DATE_SID) as LAST_ORDER_DATE
     FROM 
         F_SALES f
-    JOIN 
-        D_ITEMS d ON f.ITEM_SID = d.ITEM_SID
     GROUP BY 
-        d.ITEM_NUMBER, d.ITEM_DESCRIPTION
-    ORDER BY 
-        TOTAL_REVENUE DESC
-    LIMIT %s
+        f.ITEM_SID
     """
     try:
-        cursor = connection.cursor(dictionary=True)
-        cursor.execute(query, (limit,))
-        results = cursor.fetchall()
-        return results
-    except Error as e:
+        with stageProfiler.span('fetch', 'F_SALES by item'):
+            per_item = pd.read_sql(query, engine)
+        with stageProfiler.span('fetch', 'D_ITEMS dimension'):
+            items = dimensionStore.load_dimension(engine, 'items')
+    except Exception as e:
         print(f"Error executing query: {e}")
         return None
 
+    # Items missing from D_ITEMS are dropped, as the inner join did
+    with stageProfiler.span('aggregate', 'top products'):
+        rows = dimensionStore.resolve_rows(items, per_item['ITEM_SID'])
+        per_item = per_item[rows >= 0].copy()
+        rows = rows[rows >= 0]
+        per_item['ITEM_NUMBER'] = dimensionStore.lookup(items, 'ITEM_NUMBER', None, rows=rows)
+        per_item['ITEM_DESCRIPTION'] = dimensionStore.lookup(items, 'ITEM_DESCRIPTION', None, rows=rows)
+
+        products = per_item.groupby(['ITEM_NUMBER', 'ITEM_DESCRIPTION']).agg(
+            TOTAL_QUANTITY=('TOTAL_QUANTITY', 'sum'),
+            TOTAL_REVENUE=('TOTAL_REVENUE', 'sum'),
+            UNIT_PRICE_SUM=('UNIT_PRICE_SUM', 'sum'),
+            UNIT_PRICE_COUNT=('UNIT_PRICE_COUNT', 'sum'),
+            TOTAL_COST=('TOTAL_COST', lambda s: s.sum(min_count=1)),
+            FIRST_ORDER_DATE=('FIRST_ORDER_DATE', 'min'),
+            LAST_ORDER_DATE=('LAST_ORDER_DATE', 'max'),
+        ).reset_index()
+        products['AVG_UNIT_PRICE'] = products['UNIT_PRICE_SUM'] / products['UNIT_PRICE_COUNT']
+        products['GROSS_PROFIT'] = products['TOTAL_REVENUE'] - products['TOTAL_COST']
+        products = products.sort_values('TOTAL_REVENUE', ascending=False).head(limit)
+        products = products.drop(columns=['UNIT_PRICE_SUM', 'UNIT_PRICE_COUNT'])
+
+    # Keep the cursor-style output: list of dicts with None for missing costs
+    return products.astype(object).where(products.notna(), None).to_dict('records')
+
 
 def main():
     db_config = read_config()
-    connection = connect_to_database(db_config)
-
-    if connection:
-        top_products = get_top_products_by_revenue(connection)
-
-        if top_products:
-            print("\nTop Products by Revenue:")
-            print("{:<15} {:<30} {:<15} {:<15} {:<15} {:<15} {:<15} {:<15} {:<15}".format(
-                "Item Number", "Description", "Total Quantity", "Total Revenue", "Avg Unit Price",
-                "Total Cost", "Gross Profit", "First Order", "Last Order"))
-            print("-" * 150)
-            for product in top_products:
-                print("{:<15} {:<30} {:<15} ${:<14.2f} ${:<14.2f} ${:<14.2f} ${:<14.2f} {:<15} {:<15}".format(
-                    product['ITEM_NUMBER'],
-                    product['ITEM_DESCRIPTION'][:27] + '...' if len(product['ITEM_DESCRIPTION']) > 30 else product[
-                        'ITEM_DESCRIPTION'],
-                    product['TOTAL_QUANTITY'],
-                    Decimal(product['TOTAL_REVENUE']),
-                    Decimal(product['AVG_UNIT_PRICE']),
-                    Decimal(product['TOTAL_COST']) if product['TOTAL_COST'] is not None else Decimal('0.00'),
-                    Decimal(product['GROSS_PROFIT']) if product['GROSS_PROFIT'] is not None else Decimal('0.00'),
-                    str(product['FIRST_ORDER_DATE']),
-                    str(product['LAST_ORDER_DATE'])
-                ))
-        else:
-            print("No data found or error occurred.")
-
-        connection.close()
-        print("\nMySQL connection closed")
+    engine = create_db_engine(db_config)
+
+    top_products = get_top_products_by_revenue(engine)
+
+    if top_products:
+        print("\nTop Products by Revenue:")
+        print("{:<15} {:<30} {:<15} {:<15} {:<15} {:<15} {:<15} {:<15} {:<15}".format(
+            "Item Number", "Description", "Total Quantity", "Total Revenue", "Avg Unit Price",
+            "Total Cost", "Gross Profit", "First Order", "Last Order"))
+        print("-" * 150)
+        for product in top_products:
+            print("{:<15} {:<30} {:<15} ${:<14.2f} ${:<14.2f} ${:<14.2f} ${:<14.2f} {:<15} {:<15}".format(
+                product['ITEM_NUMBER'],
+                product['ITEM_DESCRIPTION'][:27] + '...' if len(product['ITEM_DESCRIPTION']) > 30 else product[
+                    'ITEM_DESCRIPTION'],
+                product['TOTAL_QUANTITY'],
+                Decimal(product['TOTAL_REVENUE']),
+                Decimal(product['AVG_UNIT_PRICE']),
+                Decimal(product['TOTAL_COST']) if product['TOTAL_COST'] is not None else Decimal('0.00'),
+                Decimal(product['GROSS_PROFIT']) if product['GROSS_PROFIT'] is not None else Decimal('0.00'),
+                str(product['FIRST_ORDER_DATE']),
+                str(product['LAST_ORDER_DATE'])
+            ))
+    else:
+        print("No data found or error occurred.")
+
+    engine.dispose()
+    print("\nMySQL connection closed")
 
 
 if __name__ == "__main__":